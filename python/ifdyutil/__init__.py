@@ -24,5 +24,31 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 #
 #import file
 
-__all__ = ['gui', 'file', 'snapshot', 'net', 'config', 'archive', 'nagios']
+import sys
+import types
+import importlib
+
+__all__ = [
+    'gui', 'file', 'snapshot', 'net', 'config', 'archive', 'nagios', 'runner',
+    'console'
+]
+
+class _LazyPackage( types.ModuleType ):
+
+    ''' Stand-in for this package that imports submodules the first time they
+    are used as attributes, so "import ifdyutil" costs next to nothing. '''
+
+    def __getattr__( self, name ):
+        if name in __all__:
+            return importlib.import_module( '.' + name, __name__ )
+        raise AttributeError( "'module' object has no attribute '{}'".format(
+            name
+        ) )
+
+_lazy = _LazyPackage( __name__, __doc__ )
+_lazy.__dict__.update( sys.modules[__name__].__dict__ )
+
+# Keep the real module around, or its globals are cleared when it's replaced.
+_lazy._module = sys.modules[__name__]
+sys.modules[__name__] = _lazy
 
@@ -19,27 +19,53 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import logging
+import contextlib
 import StringIO
 import zipfile
-import pbkdf2
 import struct
 import base64
-import whoosh.qparser
-import whoosh.fields
-import whoosh.query
-import whoosh.filedb.filestore
-from Crypto import Random
-from Crypto.Cipher import AES
+import re
+import fnmatch
+import collections
+import threading
+import Queue
+import zlib
+import time
+import sys
+import argparse
+import getpass
+
+# whoosh, pbkdf2 and PyCrypto are imported by the functions that need them, as
+# they are slow to import.
 
 CHUNK_LEN = 64 * 1024
 VERSIONS = ['RND1']
 
+# Default worker count for grep() and verify().
+ARCHIVE_THREADS = 4
+
+# verify() hands ZIP members up to this compressed size to its worker threads.
+# Larger members are checked in place so memory use stays bounded.
+VERIFY_MEMBER_MAX = 4 * 1024 * 1024
+
 def _salt_paths( archive_path ):
     return [
         os.path.join( os.path.dirname( archive_path ), 'salt.txt' ),
         os.path.join( os.path.expanduser( '~' ), '.saltzaes.txt' ),
     ]
 
+@contextlib.contextmanager
+def _open_archive( archive_path, mode ):
+
+    ''' Open archive_path with mode, or pass it through if it is already a
+    file-like object (e.g. a net.ssh_upload() stream). '''
+
+    if isinstance( archive_path, basestring ):
+        with open( archive_path, mode ) as archive_file:
+            yield archive_file
+    else:
+        yield archive_path
+
 def extract( archive_file, extract_path, files=None ):
 
     logger = logging.getLogger( 'ifdyutil.archive.extract' )
@@ -58,6 +84,10 @@ def search( archive_file, search_phrase ):
 
     ''' Search the given archive for logs with the given terms. '''
 
+    import whoosh.qparser
+    import whoosh.fields
+    import whoosh.filedb.filestore
+
     logger = logging.getLogger( 'ifdyutil.archive.search' )
 
     # Load the index into a storage unit.
@@ -93,67 +123,278 @@ def search( archive_file, search_phrase ):
 
     return result_list
 
-def handle( archive_path, key, salt=None ):
-    
-    ''' Open the given archive and return a zipfile handle. '''
+def _clone_zip( archive_file ):
 
-    logger = logging.getLogger( 'ifdyutil.archive.handle' )
+    ''' Return a second ZipFile over the same data as archive_file, so members
+    can be read from another thread, or None if that isn't possible. '''
 
-    # Try to load the salt from a salt file.
-    # TODO: Add a versioning system to the file with salt in header.
-    if not salt:
-        for salt_path in _salt_paths( archive_path ):
-            try:
-                with open( salt_path, 'r' ) as salt_file:
-                    salt = salt_file.readline().strip()
-                    logger.info( 'Salt found: {}'.format( salt_path ) )
+    if hasattr( archive_file.fp, 'getvalue' ):
+        # handle() archives live in a StringIO; share its buffer.
+        return zipfile.ZipFile( StringIO.StringIO( archive_file.fp.getvalue() ) )
+    elif archive_file.filename and os.path.isfile( archive_file.filename ):
+        return zipfile.ZipFile( archive_file.filename )
+    return None
+
+class _GrepState( object ):
+
+    ''' Results of a grep() shared between its workers. Once the members up
+    to cutoff are finished and hold max_matches between them, members after
+    cutoff are no longer needed. '''
+
+    def __init__( self, member_count, max_matches ):
+        self.max_matches = max_matches
+        self.results = [None] * member_count
+        self.cutoff = member_count
+        self._lock = threading.Lock()
+
+    def done( self, index, matches ):
+        with self._lock:
+            self.results[index] = matches
+            if None == self.max_matches:
+                return
+            total = 0
+            for i, member_matches in enumerate( self.results[:self.cutoff] ):
+                if None == member_matches:
+                    break
+                total += len( member_matches )
+                if self.max_matches <= total:
+                    self.cutoff = i
+                    break
+
+    def matches( self ):
+
+        ''' Return the first max_matches matches in archive order. '''
+
+        result_list = []
+        for member_matches in self.results[:self.cutoff + 1]:
+            if None != member_matches:
+                result_list.extend( member_matches )
+        if None != self.max_matches:
+            result_list = result_list[:self.max_matches]
+        return result_list
+
+def _grep_member( archive_file, index, info, regex, context, state ):
+
+    ''' Stream info out of archive_file and return its matching lines, up
+    to state.max_matches of them, or None if it turns out not to be needed. '''
+
+    matches = []
+    waiting = []
+    before = collections.deque( maxlen=context )
+    with archive_file.open( info ) as member:
+        for line_num, line in enumerate( member, 1 ):
+            if index > state.cutoff:
+                return None
+            line = line.rstrip( '\r\n' )
+
+            # Fill in trailing context for earlier matches.
+            if waiting:
+                for match in waiting:
+                    match['after'].append( line )
+                waiting = [m for m in waiting if context > len( m['after'] )]
+
+            if None != state.max_matches and \
+            state.max_matches <= len( matches ):
+                # Enough here already; just finish the last one's context.
+                if not waiting:
+                    break
+                continue
+
+            if regex.search( line ):
+                match = {
+                    'filename': info.filename,
+                    'line': line_num,
+                    'text': line,
+                    'before': list( before ),
+                    'after': [],
+                }
+                matches.append( match )
+                if 0 < context:
+                    waiting.append( match )
+            before.append( line )
+    return matches
+
+def _grep_worker( archive_file, info_queue, regex, context, state ):
+    while True:
+        work = info_queue.get()
+        if None == work:
+            break
+        index, info = work
+        if index > state.cutoff:
+            continue
+        matches = _grep_member( archive_file, index, info, regex, context, state )
+        if None != matches:
+            state.done( index, matches )
+
+def grep(
+    archive_file, pattern, members=None, context=0, max_matches=None,
+    threads=ARCHIVE_THREADS, flags=0
+):
+
+    ''' Search the members of a zipfile handle line by line for pattern, a
+    regex string or compiled regex. Unlike search(), this works on archives
+    created without an index.
+
+    members is a list of shell-style patterns; only member names matching one
+    of them are read. Returns a list of dicts with the filename, line number,
+    line text and up to context lines before and after each match, in archive
+    order. If max_matches is given, only the first max_matches are returned,
+    and members are no longer read once those are known. '''
+
+    logger = logging.getLogger( 'ifdyutil.archive.grep' )
+
+    if isinstance( pattern, basestring ):
+        pattern = re.compile( pattern, flags )
+
+    infos = []
+    for info in archive_file.infolist():
+        if info.filename.startswith( '/index' ) or \
+        info.filename.endswith( '/' ):
+            continue
+        if None != members and \
+        not any( fnmatch.fnmatch( info.filename, m ) for m in members ):
+            continue
+        infos.append( info )
+
+    state = _GrepState( len( infos ), max_matches )
+
+    archives = [archive_file]
+    if 1 < threads and 1 < len( infos ):
+        for i in range( min( threads, len( infos ) ) - 1 ):
+            clone = _clone_zip( archive_file )
+            if None == clone:
+                logger.debug( 'Archive cannot be shared; grepping serially.' )
                 break
-            except:
-                logger.warning( 'No salt found: {}'.format( salt_path ) )
-
-    with open( archive_path, 'rb' ) as archive_file:
-        archive_current = 0
-        archive_v_num = 0
-
-        # Get the file version.
-        archive_version = archive_file.read( 4 )
-        if not archive_version in VERSIONS:
-            logger.warn( 'Archive has no valid version.' )
-            archive_file.seek( 0, os.SEEK_SET )
-            archive_version = None
-        else:
-            archive_current += 4
+            archives.append( clone )
+
+    info_queue = Queue.Queue()
+    for work in enumerate( infos ):
+        info_queue.put( work )
+    for archive in archives:
+        info_queue.put( None )
+
+    if 1 == len( archives ):
+        _grep_worker( archive_file, info_queue, pattern, context, state )
+    else:
+        workers = []
+        for archive in archives:
+            worker = threading.Thread(
+                target=_grep_worker,
+                args=(archive, info_queue, pattern, context, state)
+            )
+            worker.daemon = True
+            worker.start()
+            workers.append( worker )
+        for worker in workers:
+            worker.join()
+        for archive in archives[1:]:
+            archive.close()
 
-            # TODO: Determine the numeric part of the version.
+    return state.matches()
 
-            archive_v_num = 1
+def _load_salt( archive_path, logger ):
 
-        # Newer archives store the salt in the header.
-        if 1 <= archive_v_num:
-            logger.info( 'Salt in header for archive: {}'.format( archive_path ) )
-            salt = archive_file.read( 160 )
-            archive_current += 160
-            logger.debug( 'Salt read: {}'.format(
-                base64.b64encode( salt )
-            ) )
+    ''' Try to load the salt for an old unversioned archive from a salt
+    file. '''
+
+    # TODO: Add a versioning system to the file with salt in header.
+    for salt_path in _salt_paths( archive_path ):
+        try:
+            with open( salt_path, 'r' ) as salt_file:
+                salt = salt_file.readline().strip()
+                logger.info( 'Salt found: {}'.format( salt_path ) )
+            return salt
+        except:
+            logger.warning( 'No salt found: {}'.format( salt_path ) )
+    return None
+
+def _read_header( archive_file, logger ):
+
+    ''' Read the archive header. Return (version, salt, size, iv), where salt
+    is None for archives that predate salt in the header. '''
+
+    salt = None
+    archive_v_num = 0
+
+    # Get the file version. Old archives have none, in which case these bytes
+    # begin the size. They are kept rather than seeked back over, so streams
+    # such as net.ssh_download() work too.
+    archive_version = archive_file.read( 4 )
+    size_bytes = ''
+    if not archive_version in VERSIONS:
+        logger.warn( 'Archive has no valid version.' )
+        size_bytes = archive_version
+        archive_version = None
+    else:
+        # TODO: Determine the numeric part of the version.
+        archive_v_num = 1
+
+    # Newer archives store the salt in the header.
+    if 1 <= archive_v_num:
+        salt = archive_file.read( 160 )
+        logger.debug( 'Salt read: {}'.format( base64.b64encode( salt ) ) )
+
+    size_bytes += archive_file.read( struct.calcsize( 'Q' ) - len( size_bytes ) )
+    if struct.calcsize( 'Q' ) != len( size_bytes ):
+        raise IOError( 'Archive header is truncated.' )
+    archive_size = struct.unpack( '<Q', size_bytes )[0]
+    iv = archive_file.read( 16 )
+
+    return archive_version, salt, archive_size, iv
+
+def _decrypt_chunks( archive_file, decryptor, archive_size, counts=None ):
+
+    ''' Generate the decrypted payload in CHUNK_LEN pieces, trimmed of
+    padding to archive_size. If given, counts['payload'] is kept up to date
+    with the number of encrypted bytes read. '''
+
+    remaining = archive_size
+    carry = ''
+    while True:
+        chunk = archive_file.read( CHUNK_LEN )
+        if 0 == len( chunk ):
+            break
+        if None != counts:
+            counts['payload'] += len( chunk )
+        if 0 >= remaining:
+            # Padding; count it but don't bother decrypting it.
+            continue
+
+        # Short reads from streams may split a cipher block.
+        chunk = carry + chunk
+        usable = len( chunk ) - len( chunk ) % 16
+        carry = chunk[usable:]
+        plain = decryptor.decrypt( chunk[:usable] )
+        yield plain[:remaining]
+        remaining -= len( plain )
+
+def handle( archive_path, key, salt=None ):
+    
+    ''' Open the given archive and return a zipfile handle. archive_path may
+    also be a readable file-like object, such as a net.ssh_download(). '''
 
-        archive_size = struct.unpack(
-            '<Q', archive_file.read( struct.calcsize( 'Q' ) )
-        )[0]
-        archive_current += struct.calcsize( 'Q' )
-        iv = archive_file.read( 16 )
-        archive_current += 16
+    import pbkdf2
+    from Crypto.Cipher import AES
+
+    logger = logging.getLogger( 'ifdyutil.archive.handle' )
+
+    with _open_archive( archive_path, 'rb' ) as archive_file:
+        archive_version, header_salt, archive_size, iv = \
+            _read_header( archive_file, logger )
+        if None != header_salt:
+            logger.info( 'Salt in header for archive: {}'.format(
+                archive_path
+            ) )
+            salt = header_salt
+        elif not salt and isinstance( archive_path, basestring ):
+            salt = _load_salt( archive_path, logger )
 
         # Begin decrypting the archive data.
         key_crypt = pbkdf2.PBKDF2( key, salt ).read( 32 )
         decryptor = AES.new( key_crypt, AES.MODE_CBC, iv )
-        plain_string = ''
-        while True:
-            chunk = archive_file.read( CHUNK_LEN )
-            archive_current += CHUNK_LEN
-            if 0 == len( chunk ):
-                break
-            plain_string = plain_string + decryptor.decrypt( chunk )
+        plain_string = ''.join(
+            _decrypt_chunks( archive_file, decryptor, archive_size )
+        )
 
     # Open the decrypted string as a ZIP file.
     try:
@@ -165,12 +406,26 @@ def handle( archive_path, key, salt=None ):
         ) )
         return None
 
-def create( archive_path, key, salt=None, item_list=[], index=True ):
+def create(
+    archive_path, key, salt=None, item_list=[], index=True, progress=None
+):
 
     ''' Item list must be in the format:
-    [{'path_rel, 'contents'}] '''
+    [{'path_rel, 'contents'}]
+
+    archive_path may also be a writable file-like object, such as a
+    net.ssh_upload(), in which case nothing is written to local disk. Only the
+    encryption is streamed: the header records the ZIP's length up front, so
+    the whole ZIP is still built in memory before the first byte is written.
 
-    # TODO: Add archive_current status update stuff.
+    progress, if given, is called as progress( items, nbytes, name ) for each
+    item stored, e.g. with a console.Progress. '''
+
+    import pbkdf2
+    import whoosh.fields
+    import whoosh.filedb.filestore
+    from Crypto import Random
+    from Crypto.Cipher import AES
 
     logger = logging.getLogger( 'ifdyutil.archive.create' )
 
@@ -191,7 +446,8 @@ def create( archive_path, key, salt=None, item_list=[], index=True ):
         ix = ix_storage.create_index( schema )
         ix_writer = ix.writer()
     
-    # Read all of the logs and write them to the archive ZIP.
+    # Read all of the logs and write them to the archive ZIP. This has to be
+    # finished before the header can be written, see above.
     arcio = StringIO.StringIO()
     total_bytes = 0
     with zipfile.ZipFile( arcio, 'w', zipfile.ZIP_DEFLATED ) as arcz:
@@ -212,26 +468,28 @@ def create( archive_path, key, salt=None, item_list=[], index=True ):
 
             # Index the item if applicable.
             if index:
-                logger.info( 'Indexing {}...'.format( item['path_rel'] ) )
+                logger.debug( 'Indexing {}...'.format( item['path_rel'] ) )
                 ix_writer.add_document(
                     path=item['path_rel'][1:],
                     content=item['contents']
                 )
 
             # Store the item.
-            logger.info( 'Storing {}...'.format( item['path_rel'] ) )
+            logger.debug( 'Storing {}...'.format( item['path_rel'] ) )
             arcz.writestr(
                 item['path_rel'].decode( 'ascii' ),
                 item['contents'].decode( 'ascii' )
             )
             total_bytes += len( item['contents'] )
+            if progress:
+                progress( 1, len( item['contents'] ), item['path_rel'] )
 
         if index:
             # Write the search index to the ZIP.
             ix_writer.commit()
             for ix_file_name in ix_storage.list():
                 with ix_storage.open_file( ix_file_name ) as ix_file:
-                    logger.info( 'Storing {}...'.format( ix_file_name ) )
+                    logger.debug( 'Storing {}...'.format( ix_file_name ) )
                     ix_contents = ix_file.read()
                     arcz.writestr(
                         os.path.join( '/index', ix_file_name ),
@@ -248,7 +506,7 @@ def create( archive_path, key, salt=None, item_list=[], index=True ):
 
     # Open the output file and start writing.
     arcio.seek( 0, os.SEEK_SET )
-    with open( archive_path, 'wb' ) as archive_file:
+    with _open_archive( archive_path, 'wb' ) as archive_file:
         archive_file.write( VERSIONS[len( VERSIONS ) - 1] )
         archive_file.write( salt )
         archive_file.write( struct.pack( '<Q', len( arcio.getvalue() ) ) )
@@ -264,3 +522,356 @@ def create( archive_path, key, salt=None, item_list=[], index=True ):
                 chunk += ' ' * (16 - len( chunk ) % 16)
             archive_file.write( encryptor.encrypt( chunk ) )
 
+class _StreamReader( object ):
+
+    ''' Exact-length reads over a generator of chunks. '''
+
+    def __init__( self, chunks ):
+        self._chunks = chunks
+        self._buf = ''
+        self.offset = 0
+
+    def read( self, size ):
+        parts = [self._buf]
+        have = len( self._buf )
+        while have < size:
+            chunk = next( self._chunks, None )
+            if None == chunk:
+                break
+            parts.append( chunk )
+            have += len( chunk )
+        data = ''.join( parts )
+        self._buf = data[size:]
+        data = data[:size]
+        self.offset += len( data )
+        return data
+
+    def drain( self ):
+
+        ''' Skip to the end, counting everything left in offset. '''
+
+        self.offset += len( self._buf )
+        self._buf = ''
+        for chunk in self._chunks:
+            self.offset += len( chunk )
+
+class _MemberCheck( object ):
+
+    ''' Inflate and CRC a ZIP member fed to it piece by piece. '''
+
+    def __init__( self, name, compress_type, crc, file_size ):
+        self.name = name
+        self.crc = crc
+        self.file_size = file_size
+        self.size = 0
+        self._crc = 0
+        self._inflater = None
+        if zipfile.ZIP_DEFLATED == compress_type:
+            self._inflater = zlib.decompressobj( -15 )
+        elif zipfile.ZIP_STORED != compress_type:
+            raise ValueError( 'unsupported compression type {}'.format(
+                compress_type
+            ) )
+
+    def _update( self, data ):
+        self._crc = zlib.crc32( data, self._crc )
+        self.size += len( data )
+
+    def feed( self, data ):
+        if None == self._inflater:
+            self._update( data )
+            return
+        # Inflate at most CHUNK_LEN at a time to keep memory bounded.
+        while data:
+            self._update( self._inflater.decompress( data, CHUNK_LEN ) )
+            data = self._inflater.unconsumed_tail
+
+    def finish( self ):
+
+        ''' Return an error string, or None if the member is intact. '''
+
+        if None != self._inflater:
+            self._update( self._inflater.flush() )
+        if self.size != self.file_size:
+            return '{}: size {} does not match declared {}'.format(
+                self.name, self.size, self.file_size
+            )
+        if (self._crc & 0xffffffff) != self.crc:
+            return '{}: bad CRC'.format( self.name )
+        return None
+
+def _check_member( name, compress_type, crc, file_size, data ):
+    try:
+        check = _MemberCheck( name, compress_type, crc, file_size )
+        check.feed( data )
+        return check.finish()
+    except (ValueError, zlib.error) as exc:
+        return '{}: {}'.format( name, exc )
+
+def _verify_worker( jobs, report, report_lock, progress ):
+    while True:
+        job = jobs.get()
+        if None == job:
+            break
+        error = _check_member( *job )
+        with report_lock:
+            report['bytes'] += job[3]
+            if None != error:
+                report['errors'].append( error )
+            if progress:
+                progress( 1, job[3], job[0] )
+
+def _verify_zip_stream( reader, report, threads=ARCHIVE_THREADS, progress=None ):
+
+    ''' Walk the local file headers of a ZIP read sequentially from reader,
+    CRC-checking each member, then check the central directory agrees. Errors
+    are appended to report['errors']. '''
+
+    report_lock = threading.Lock()
+    jobs = Queue.Queue( 2 * threads )
+    workers = []
+    for i in range( threads ):
+        worker = threading.Thread(
+            target=_verify_worker, args=(jobs, report, report_lock, progress)
+        )
+        worker.daemon = True
+        worker.start()
+        workers.append( worker )
+
+    def error( message ):
+        with report_lock:
+            report['errors'].append( message )
+
+    try:
+        while True:
+            header_offset = reader.offset
+            signature = reader.read( 4 )
+            if zipfile.stringFileHeader != signature:
+                break
+
+            header = reader.read( zipfile.sizeFileHeader - 4 )
+            if zipfile.sizeFileHeader - 4 != len( header ):
+                error( 'Truncated member header at offset {}'.format(
+                    header_offset
+                ) )
+                return
+            fields = struct.unpack( zipfile.structFileHeader, signature + header )
+            name = reader.read( fields[zipfile._FH_FILENAME_LENGTH] )
+            reader.read( fields[zipfile._FH_EXTRA_FIELD_LENGTH] )
+            compress_size = fields[zipfile._FH_COMPRESSED_SIZE]
+            job = (
+                name,
+                fields[zipfile._FH_COMPRESSION_METHOD],
+                fields[zipfile._FH_CRC],
+                fields[zipfile._FH_UNCOMPRESSED_SIZE],
+            )
+
+            # Without the sizes up front the rest can't be walked.
+            if fields[zipfile._FH_GENERAL_PURPOSE_FLAG_BITS] & 0x09 or \
+            0xffffffff == compress_size:
+                error( '{}: unsupported member format'.format( name ) )
+                return
+            report['members'] += 1
+
+            if VERIFY_MEMBER_MAX >= compress_size:
+                data = reader.read( compress_size )
+                if len( data ) != compress_size:
+                    error( '{}: truncated'.format( name ) )
+                    return
+                jobs.put( job + (data,) )
+                continue
+
+            # Too big to queue; stream it through here.
+            try:
+                check = _MemberCheck( *job )
+                remaining = compress_size
+                while 0 < remaining:
+                    data = reader.read( min( remaining, CHUNK_LEN ) )
+                    if 0 == len( data ):
+                        error( '{}: truncated'.format( name ) )
+                        return
+                    check.feed( data )
+                    remaining -= len( data )
+                member_error = check.finish()
+            except (ValueError, zlib.error) as exc:
+                member_error = '{}: {}'.format( name, exc )
+            with report_lock:
+                report['bytes'] += job[3]
+                if None != member_error:
+                    report['errors'].append( member_error )
+                if progress:
+                    progress( 1, job[3], name )
+
+        # The central directory should list every member we found.
+        directory_count = 0
+        while zipfile.stringCentralDir == signature:
+            header = reader.read( zipfile.sizeCentralDir - 4 )
+            if zipfile.sizeCentralDir - 4 != len( header ):
+                break
+            fields = struct.unpack( zipfile.structCentralDir, signature + header )
+            reader.read(
+                fields[zipfile._CD_FILENAME_LENGTH] +
+                fields[zipfile._CD_EXTRA_FIELD_LENGTH] +
+                fields[zipfile._CD_COMMENT_LENGTH]
+            )
+            directory_count += 1
+            header_offset = reader.offset
+            signature = reader.read( 4 )
+
+        if zipfile.stringEndArchive != signature:
+            if 0 == header_offset:
+                error( 'Payload is not a ZIP file; wrong key?' )
+            else:
+                error( 'Unexpected data at offset {}'.format( header_offset ) )
+            return
+        header = reader.read( zipfile.sizeEndCentDir - 4 )
+        if zipfile.sizeEndCentDir - 4 != len( header ):
+            error( 'Truncated end of central directory' )
+            return
+        fields = struct.unpack( zipfile.structEndArchive, signature + header )
+        if directory_count != report['members'] or \
+        fields[zipfile._ECD_ENTRIES_TOTAL] != report['members']:
+            error( 'Central directory lists {} members, found {}'.format(
+                fields[zipfile._ECD_ENTRIES_TOTAL], report['members']
+            ) )
+
+    finally:
+        for worker in workers:
+            jobs.put( None )
+        for worker in workers:
+            worker.join()
+
+def verify(
+    archive_path, key, salt=None, threads=ARCHIVE_THREADS, progress=None
+):
+
+    ''' Check an archive is intact without extracting it. The payload is
+    decrypted and each ZIP member inflated and CRC-checked as it streams past,
+    so memory use stays bounded whatever the archive size.
+
+    Returns a report dict with the archive version, declared and actual
+    payload sizes, member and byte counts, elapsed time, throughput and a
+    list of errors, which is empty if the archive is intact. progress is
+    called as in create() for each member checked. '''
+
+    import pbkdf2
+    from Crypto.Cipher import AES
+
+    logger = logging.getLogger( 'ifdyutil.archive.verify' )
+
+    report = {
+        'path': archive_path,
+        'version': None,
+        'declared_size': None,
+        'payload': 0,
+        'members': 0,
+        'bytes': 0,
+        'elapsed': 0.0,
+        'rate': 0.0,
+        'errors': [],
+    }
+    started = time.time()
+
+    with _open_archive( archive_path, 'rb' ) as archive_file:
+        try:
+            archive_version, header_salt, archive_size, iv = \
+                _read_header( archive_file, logger )
+        except IOError as exc:
+            report['errors'].append( str( exc ) )
+            logger.error( '{}: {}'.format( archive_path, exc ) )
+            return report
+        report['version'] = archive_version
+        report['declared_size'] = archive_size
+        if None != header_salt:
+            salt = header_salt
+        elif not salt and isinstance( archive_path, basestring ):
+            salt = _load_salt( archive_path, logger )
+
+        if 16 != len( iv ):
+            report['errors'].append( 'Truncated header' )
+        else:
+            key_crypt = pbkdf2.PBKDF2( key, salt ).read( 32 )
+            decryptor = AES.new( key_crypt, AES.MODE_CBC, iv )
+            reader = _StreamReader( _decrypt_chunks(
+                archive_file, decryptor, archive_size, report
+            ) )
+            _verify_zip_stream( reader, report, threads, progress )
+
+            # Read to the end so the payload size can be checked.
+            reader.drain()
+            if archive_size > reader.offset:
+                report['errors'].append(
+                    'Payload is {} bytes, header declares {}'.format(
+                        reader.offset, archive_size
+                    )
+                )
+
+            # The payload is padded to the cipher block size.
+            padded_size = archive_size + (-archive_size % 16)
+            if padded_size != report['payload']:
+                report['errors'].append(
+                    'Encrypted payload is {} bytes, expected {}'.format(
+                        report['payload'], padded_size
+                    )
+                )
+
+    report['elapsed'] = time.time() - started
+    if 0 < report['elapsed']:
+        report['rate'] = report['payload'] / report['elapsed']
+    for message in report['errors']:
+        logger.error( '{}: {}'.format( archive_path, message ) )
+    return report
+
+def main( argv=None ):
+
+    ''' Command line interface to verify(). '''
+
+    import console
+
+    parser = argparse.ArgumentParser(
+        description='Verify archives without extracting them.'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=ARCHIVE_THREADS,
+        help='Number of members to check at once.'
+    )
+    parser.add_argument(
+        '-k', '--key-file', default=None,
+        help='File containing the archive key. Prompted for if not given.'
+    )
+    parser.add_argument( 'archives', nargs='+', help='Archives to verify.' )
+    args = parser.parse_args( argv )
+
+    if args.key_file:
+        with open( args.key_file ) as key_file:
+            key = key_file.readline().rstrip( '\n' )
+    else:
+        key = getpass.getpass( 'Archive key: ' )
+
+    status = 0
+    total_bytes = 0
+    started = time.time()
+    for archive_path in args.archives:
+        report = verify( archive_path, key, threads=args.jobs )
+        total_bytes += report['payload']
+        if report['errors']:
+            status = 1
+            state = 'FAILED ({})'.format( '; '.join( report['errors'] ) )
+        else:
+            state = 'OK'
+        sys.stderr.write( '{}: {}, {} members, {} in {:.2f}s ({}/s)\n'.format(
+            archive_path, state, report['members'],
+            console.format_bytes( report['payload'] ), report['elapsed'],
+            console.format_bytes( report['rate'] )
+        ) )
+
+    elapsed = max( time.time() - started, 1e-6 )
+    sys.stderr.write( 'Verified {} archives, {} at {}/s\n'.format(
+        len( args.archives ), console.format_bytes( total_bytes ),
+        console.format_bytes( total_bytes / elapsed )
+    ) )
+
+    return status
+
+if __name__ == '__main__':
+    sys.exit( main() )
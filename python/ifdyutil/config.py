@@ -19,6 +19,43 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 
 import re
 import os
+import threading
+import struct
+import select
+import ctypes
+import ctypes.util
+import logging
+import atexit
+
+SYSTEM_CONFIG_PATH = '/etc/qnvars.sh'
+USER_CONFIG_NAME = 'qnvars.sh'
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_CONFIG_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | \
+    IN_DELETE
+INOTIFY_EVENT = 'iIII'
+
+# Seconds the watcher waits for events between checks for being stopped.
+WATCH_TICK = 1.0
+
+_pattern_config_var = re.compile( r'^(#)?(\S*)=(\S*)' )
+
+# The last config parsed, along with the stat stamps of the files it came from.
+_cache = {'stamps': None, 'cfg': None}
+_cache_lock = threading.Lock()
+
+_subscribers = []
+_watcher = None
+_watch_registered = False
+
+# The config subscribers last heard about. Kept apart from _cache, which any
+# load() may refresh before the watcher gets to it.
+_delivered = {'cfg': None}
+_delivered_lock = threading.Lock()
 
 class MissingConfigException( Exception ):
     pass
@@ -26,36 +63,194 @@ class MissingConfigException( Exception ):
 class InsufficientPrivsException( Exception ):
     pass
 
-def load():
+def _config_paths():
+    return [
+        SYSTEM_CONFIG_PATH,
+        os.path.join( os.path.expanduser( '~' ), USER_CONFIG_NAME ),
+    ]
 
-    ''' Return the config for ifdy-scripts. Conglomerate system-wide config in
-    etc with user-specific config in ~/.qnvars.sh. '''
+def _stamp( path ):
+
+    ''' Return something that changes whenever the file at path does. '''
+
+    try:
+        st = os.stat( path )
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino, st.st_dev)
+
+def _parse( config_file, cfg ):
+    for line in config_file:
+        config_match = _pattern_config_var.match( line )
+        if None != config_match and None == config_match.groups()[0]:
+            cfg[config_match.groups()[1]] = config_match.groups()[2]
 
-    pattern_config_var = re.compile( r'^(#)?(\S*)=(\S*)' )
+def _load_uncached():
+    system_path, user_path = _config_paths()
 
     cfg = {}
 
-    with open( '/etc/qnvars.sh' ) as system_config_file:
+    with open( system_path ) as system_config_file:
         # Load the system-wide config.
-        for line in system_config_file:
-            config_match = pattern_config_var.match( line )
-            if None != config_match and None == config_match.groups()[0]:
-                cfg[config_match.groups()[1]] = config_match.groups()[2]
+        _parse( system_config_file, cfg )
 
     try:
-        with open( os.path.join( os.path.expanduser( '~' ), 'qnvars.sh' ) ) \
-        as system_config_file:
+        with open( user_path ) as system_config_file:
             # Override settings with those found in the per-user config.
-            for line in system_config_file:
-                config_match = pattern_config_var.match( line )
-                if None != config_match and None == config_match.groups()[0]:
-                    cfg[config_match.groups()[1]] = config_match.groups()[2]
+            _parse( system_config_file, cfg )
     except:
         # Per-user config is optional.
         pass
 
     return cfg
 
+def _load_cached( force=False ):
+
+    ''' Return the shared cached config, re-parsing it only if one of the
+    files behind it has changed. Callers must not modify the result. '''
+
+    stamps = [_stamp( path ) for path in _config_paths()]
+    with _cache_lock:
+        if force or stamps != _cache['stamps'] or None == _cache['cfg']:
+            _cache['cfg'] = _load_uncached()
+            _cache['stamps'] = stamps
+        return _cache['cfg']
+
+def load():
+
+    ''' Return the config for ifdy-scripts. Conglomerate system-wide config in
+    etc with user-specific config in ~/.qnvars.sh. The files are only re-read
+    if they have changed since the last call. '''
+
+    return dict( _load_cached() )
+
+def subscribe( callback ):
+
+    ''' Call callback( cfg ) whenever the watcher started by watch() finds
+    the config has changed. '''
+
+    if not callback in _subscribers:
+        _subscribers.append( callback )
+
+def unsubscribe( callback ):
+    if callback in _subscribers:
+        _subscribers.remove( callback )
+
+def reload():
+
+    ''' Re-read the config and notify subscribers if it changed. '''
+
+    logger = logging.getLogger( 'ifdyutil.config.reload' )
+
+    try:
+        cfg = _load_cached( force=True )
+    except IOError as exc:
+        # Probably caught mid-replace. The next event will try again.
+        logger.warning( 'Unable to reload config: {}'.format( exc ) )
+        return
+
+    with _delivered_lock:
+        if cfg == _delivered['cfg']:
+            return
+        _delivered['cfg'] = cfg
+        for callback in list( _subscribers ):
+            callback( dict( cfg ) )
+
+class _ConfigWatcher( threading.Thread ):
+
+    ''' Wait on inotify events for the directories holding the config files
+    and reload when one of the files is written, replaced or removed. '''
+
+    def __init__( self, libc ):
+        threading.Thread.__init__( self )
+        self.daemon = True
+        self._stop_event = threading.Event()
+        self._fd = libc.inotify_init()
+        if 0 > self._fd:
+            raise OSError( ctypes.get_errno(), 'inotify_init failed' )
+
+        # Written to by stop() to wake the thread up straight away.
+        self._wake_read, self._wake_write = os.pipe()
+
+        # Watch directories, since editors often replace files by renaming.
+        self._names = {}
+        for path in _config_paths():
+            dir_path, name = os.path.split( path )
+            wd = libc.inotify_add_watch( self._fd, dir_path, IN_CONFIG_MASK )
+            if 0 <= wd:
+                self._names.setdefault( wd, set() ).add( name )
+
+    def _changed( self, data ):
+        event_len = struct.calcsize( INOTIFY_EVENT )
+        offset = 0
+        changed = False
+        while offset + event_len <= len( data ):
+            wd, mask, cookie, name_len = \
+                struct.unpack_from( INOTIFY_EVENT, data, offset )
+            name = data[offset + event_len:offset + event_len + name_len]
+            if name.rstrip( '\0' ) in self._names.get( wd, () ):
+                changed = True
+            offset += event_len + name_len
+        return changed
+
+    def run( self ):
+        try:
+            while not self._stop_event.is_set():
+                ready = select.select(
+                    [self._fd, self._wake_read], [], [], WATCH_TICK
+                )[0]
+                if self._fd in ready and \
+                self._changed( os.read( self._fd, 4096 ) ):
+                    reload()
+        finally:
+            os.close( self._fd )
+            os.close( self._wake_read )
+
+    def stop( self ):
+        self._stop_event.set()
+        os.write( self._wake_write, 'x' )
+        os.close( self._wake_write )
+
+def watch():
+
+    ''' Start reloading the config in the background as soon as its files
+    change. Return False if inotify isn't available. '''
+
+    global _watcher
+    global _watch_registered
+
+    if None != _watcher:
+        return True
+
+    try:
+        libc = ctypes.CDLL( ctypes.util.find_library( 'c' ), use_errno=True )
+        _watcher = _ConfigWatcher( libc )
+    except (OSError, AttributeError):
+        return False
+
+    # Changes are reported against the config as it is now.
+    with _delivered_lock:
+        try:
+            _delivered['cfg'] = _load_cached()
+        except IOError:
+            _delivered['cfg'] = None
+
+    # Stop the thread before the interpreter tears down what it uses.
+    if not _watch_registered:
+        atexit.register( unwatch )
+        _watch_registered = True
+
+    _watcher.start()
+    return True
+
+def unwatch():
+    global _watcher
+
+    if None != _watcher:
+        _watcher.stop()
+        _watcher.join()
+        _watcher = None
+
 #def check( key, cfg=None, regex=None ):
 def check_var( key, cfg=None ):
     
@@ -67,7 +262,7 @@ def check_var( key, cfg=None ):
     # TODO: Implement regex.
 
     if None == cfg:
-        cfg = load()
+        cfg = _load_cached()
 
     try:
         x = cfg[key]
@@ -19,6 +19,15 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 
 import os
 import sys
+import time
+
+# Seconds between redraws of a progress line on a terminal.
+PROGRESS_INTERVAL = 0.25
+
+# Seconds between summary lines when output is not a terminal.
+PROGRESS_SUMMARY_INTERVAL = 30.0
+
+BYTE_UNITS = ['B', 'KiB', 'MiB', 'GiB', 'TiB']
 
 class InvalidPromptResponse( Exception ):
     pass
@@ -48,3 +57,118 @@ def prompt_yn( prompt ):
     else:
         raise InvalidPromptResponse()
 
+
+def format_bytes( count ):
+
+    ''' Return count bytes as a short human-readable string. '''
+
+    count = float( count )
+    for unit in BYTE_UNITS[:-1]:
+        if 1024 > abs( count ):
+            return '{:.1f} {}'.format( count, unit )
+        count /= 1024
+    return '{:.1f} {}'.format( count, BYTE_UNITS[-1] )
+
+def format_eta( seconds ):
+
+    ''' Return seconds as H:MM:SS, or ? if unknown. '''
+
+    if None == seconds:
+        return '?'
+    seconds = int( seconds )
+    return '{}:{:02d}:{:02d}'.format(
+        seconds // 3600, (seconds // 60) % 60, seconds % 60
+    )
+
+class Progress( object ):
+
+    ''' Throughput/ETA renderer for long jobs. Feed it with update(), e.g. as
+    the progress callback of archive.create(). On a terminal it redraws one
+    line and the window title at most every interval seconds; otherwise it
+    prints a summary line every summary_interval seconds. '''
+
+    def __init__(
+        self, label, total_items=None, total_bytes=None, stream=None,
+        interval=PROGRESS_INTERVAL, summary_interval=PROGRESS_SUMMARY_INTERVAL,
+        clock=time.time
+    ):
+        self.label = label
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.stream = sys.stdout if None == stream else stream
+        self.clock = clock
+        self.items = 0
+        self.bytes = 0
+        self.name = None
+        self.started = clock()
+        self.tty = hasattr( self.stream, 'isatty' ) and self.stream.isatty()
+        self.interval = interval if self.tty else summary_interval
+        self._next_draw = self.started + self.interval
+
+    def __call__( self, items=1, nbytes=0, name=None ):
+        self.update( items, nbytes, name )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.finish()
+
+    def update( self, items=1, nbytes=0, name=None ):
+        self.items += items
+        self.bytes += nbytes
+        if None != name:
+            self.name = name
+
+        # Keep the common case to a clock read and a compare.
+        now = self.clock()
+        if now < self._next_draw:
+            return
+        self._next_draw = now + self.interval
+        self._draw( now )
+
+    def rates( self, now=None ):
+
+        ''' Return (items/sec, bytes/sec, ETA seconds or None). '''
+
+        if None == now:
+            now = self.clock()
+        elapsed = max( now - self.started, 1e-6 )
+        item_rate = self.items / elapsed
+        byte_rate = self.bytes / elapsed
+
+        eta = None
+        if self.total_bytes and byte_rate:
+            eta = max( self.total_bytes - self.bytes, 0 ) / byte_rate
+        elif self.total_items and item_rate:
+            eta = max( self.total_items - self.items, 0 ) / item_rate
+        return item_rate, byte_rate, eta
+
+    def status( self, now=None ):
+        item_rate, byte_rate, eta = self.rates( now )
+        items = str( self.items )
+        if self.total_items:
+            items = '{}/{}'.format( self.items, self.total_items )
+        return '{}: {} items, {} ({:.1f} items/s, {}/s) ETA {}'.format(
+            self.label, items, format_bytes( self.bytes ), item_rate,
+            format_bytes( byte_rate ), format_eta( eta )
+        )
+
+    def _draw( self, now ):
+        line = self.status( now )
+        if self.tty:
+            self.stream.write( '\r\x1b[K' + line )
+            if self.stream is sys.stdout:
+                set_title( line )
+        else:
+            self.stream.write( line + '\n' )
+        self.stream.flush()
+
+    def finish( self ):
+
+        ''' Draw the final totals and end the progress line. '''
+
+        self._draw( self.clock() )
+        if self.tty:
+            self.stream.write( '\n' )
+            self.stream.flush()
@@ -20,11 +20,27 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 import os
 import errno
 import mimetypes
-import subprocess
+import runner
 import re
 import logging
 import atexit
 import time
+import ctypes
+import ctypes.util
+import fnmatch
+import fcntl
+import threading
+import Queue
+import signal
+import stat
+
+try:
+    from os import scandir as _scandir
+except ImportError:
+    try:
+        from scandir import scandir as _scandir
+    except ImportError:
+        _scandir = None
 
 FS_ATTRIBS_OPPOSITE = {
     'rw': 'ro',
@@ -33,37 +49,330 @@ FS_ATTRIBS_OPPOSITE = {
     'noexec': 'exec',
 }
 
+PROC_MOUNTS_PATH = '/proc/mounts'
+CRYPT_MAPPER_PATH = '/dev/mapper'
+
 FS_REMOUNT_LOCK_PATH = '/var/lock/qnrmount'
 FS_MOUNT_LOCK_PATH = '/var/lock/qnmount'
 
+# Use mount(2) directly for remounts where possible, rather than forking the
+# mount binary.
+FS_REMOUNT_SYSCALL = True
+
+MS_RDONLY = 1
+MS_NOSUID = 2
+MS_NODEV = 4
+MS_NOEXEC = 8
+MS_SYNCHRONOUS = 16
+MS_REMOUNT = 32
+MS_MANDLOCK = 64
+MS_DIRSYNC = 128
+MS_NOATIME = 1024
+MS_NODIRATIME = 2048
+MS_RELATIME = 1 << 21
+MS_STRICTATIME = 1 << 24
+MS_LAZYTIME = 1 << 25
+
+# Per-mount options from /proc/mounts that must be carried over on remount.
+FS_MOUNT_FLAGS = {
+    'ro': MS_RDONLY,
+    'nosuid': MS_NOSUID,
+    'nodev': MS_NODEV,
+    'noexec': MS_NOEXEC,
+    'sync': MS_SYNCHRONOUS,
+    'mand': MS_MANDLOCK,
+    'dirsync': MS_DIRSYNC,
+    'noatime': MS_NOATIME,
+    'nodiratime': MS_NODIRATIME,
+    'relatime': MS_RELATIME,
+    'strictatime': MS_STRICTATIME,
+    'lazytime': MS_LAZYTIME,
+}
+
 LOCK_TYPE_REMOUNT = 1
 LOCK_TYPE_MOUNT = 2
 
+# Longest sleep between attempts when a timed FileLock wait can't use SIGALRM
+# and has to retry instead.
+LOCK_RETRY_MAX = 0.1
+
 CRYPT_UNMAP_TRIES_MAX = 5
 
+# Seconds to allow external tools before giving up on them.
+PGREP_TIMEOUT = 10
+MOUNT_TIMEOUT = 60
+CRYPT_TIMEOUT = 120
+
+# Leading bytes used to identify files whose names don't give away their type.
+MIME_MAGIC = [
+    ('\x89PNG\r\n\x1a\n', 'image/png'),
+    ('\xff\xd8\xff', 'image/jpeg'),
+    ('GIF87a', 'image/gif'),
+    ('GIF89a', 'image/gif'),
+    ('%PDF-', 'application/pdf'),
+    ('PK\x03\x04', 'application/zip'),
+    ('\x1f\x8b', 'application/x-gzip'),
+    ('BZh', 'application/x-bzip2'),
+    ('\xfd7zXZ\x00', 'application/x-xz'),
+    ('\x7fELF', 'application/x-executable'),
+    ('#!', 'text/x-script'),
+]
+MIME_MAGIC_LEN = max( len( m[0] ) for m in MIME_MAGIC )
+
+SCAN_QUEUE_MAX = 64
+
+# Reference counts of remounts held by this process, keyed by (path, perm).
+_remount_refs = {}
+
+_libc = None
+
+# Locks taken through create_lock(), held until the process exits.
+_held_locks = {}
+
+# Extension lookup tables built from mimetypes on first use.
+_mime_tables = None
+
 class CryptException( Exception ):
     pass
 
+class _LockTimeout( Exception ):
+    pass
+
 class MountException( Exception ):
     pass
 
 class RemountException( Exception ):
     pass
 
-def mkdir_p( path ):
+class LockException( Exception ):
+    pass
+
+def mkdir_p( path, mode=0777 ):
     try:
-        os.makedirs( path )
+        os.makedirs( path, mode )
     except OSError as exc: # Python >2.5
         if exc.errno == errno.EEXIST and os.path.isdir( path ):
             pass
         else: raise
 
+def _get_mime_tables():
+
+    ''' Return (types, suffixes, encodings) lookup tables precomputed from the
+    mimetypes module so names can be classified without guess_type(). '''
+
+    global _mime_tables
+
+    if None == _mime_tables:
+        if not mimetypes.inited:
+            mimetypes.init()
+        _mime_tables = (
+            dict( mimetypes.types_map ), dict( mimetypes.suffix_map ), dict( mimetypes.encodings_map )
+        )
+
+    return _mime_tables
+
+def guess_mime( name ):
+
+    ''' Return the MIME type for the given file name, or None. This follows the
+    same rules as mimetypes.guess_type() for plain file names. '''
+
+    types, suffixes, encodings = _get_mime_tables()
+
+    base, ext = os.path.splitext( name )
+    while ext in suffixes:
+        base, ext = os.path.splitext( base + suffixes[ext] )
+
+    # Compressed files are typed by the extension under the compression.
+    if ext in encodings:
+        base, ext = os.path.splitext( base )
+
+    if ext in types:
+        return types[ext]
+    return types.get( ext.lower() )
+
+def sniff_mime( path ):
+
+    ''' Return the MIME type of the file at path based on its leading bytes,
+    or None if it isn't recognized. '''
+
+    try:
+        with open( path, 'rb' ) as sniff_file:
+            header = sniff_file.read( MIME_MAGIC_LEN )
+    except IOError:
+        return None
+
+    for magic, mime_type in MIME_MAGIC:
+        if header.startswith( magic ):
+            return mime_type
+    return None
+
+def _match_any( name, patterns ):
+    for pattern in patterns:
+        if fnmatch.fnmatch( name, pattern ):
+            return True
+    return False
+
+def _is_real_dir( path ):
+
+    ''' Return True if path is a directory and not a symlink to one. '''
+
+    try:
+        return stat.S_ISDIR( os.lstat( path ).st_mode )
+    except OSError:
+        return False
+
+def _scan_dir(
+    dir_path, mimetypes_in, include, exclude, sniff, recursive=True
+):
+
+    ''' Scan a single directory. Return a list of matching file paths and a
+    list of subdirectories to descend into. '''
+
+    files_out = []
+    dirs_out = []
+
+    if None != _scandir:
+        entries = (
+            (e.name, e.path, e.is_dir( follow_symlinks=False ))
+            for e in _scandir( dir_path )
+        )
+    else:
+        # Without scandir, telling directories apart costs a stat each. Only
+        # pay it up front when descending; otherwise only matches are checked.
+        entries = (
+            (name, os.path.join( dir_path, name ), None)
+            for name in os.listdir( dir_path )
+        )
+
+    for name, entry_path, is_dir in entries:
+        if exclude and _match_any( name, exclude ):
+            continue
+
+        if None == is_dir and recursive:
+            is_dir = _is_real_dir( entry_path )
+
+        if is_dir:
+            dirs_out.append( entry_path )
+            continue
+
+        if include and not _match_any( name, include ):
+            continue
+
+        if None != mimetypes_in:
+            mime_type = guess_mime( name )
+            if None == mime_type and sniff:
+                mime_type = sniff_mime( entry_path )
+            if not mime_type in mimetypes_in:
+                continue
+
+        if None == is_dir and _is_real_dir( entry_path ):
+            continue
+
+        files_out.append( entry_path )
+
+    return files_out, dirs_out
+
+def _scan_worker( dir_queue, out_queue, stop, scan_args ):
+    while not stop.is_set():
+        dir_path = dir_queue.get()
+        if None == dir_path:
+            break
+
+        try:
+            result = (dir_path,) + _scan_dir( dir_path, *scan_args ) + (None,)
+        except OSError as exc:
+            result = (dir_path, [], [], exc)
+
+        # Don't block forever if the consumer has gone away.
+        while not stop.is_set():
+            try:
+                out_queue.put( result, timeout=0.1 )
+                break
+            except Queue.Full:
+                pass
+
+        # Only queue subdirectories once the consumer has counted them, or it
+        # could see their results first and think the scan was finished.
+        for subdir in result[2]:
+            dir_queue.put( subdir )
+
+def scan_mime(
+    path, mimetypes_in=None, include=None, exclude=None, recursive=True,
+    sniff=False, threads=1
+):
+
+    ''' Generate the paths of files under path whose MIME type is in
+    mimetypes_in (or all files if it is None).
+
+    include and exclude are lists of shell-style patterns matched against
+    entry names. Excluded directories are not descended into. If sniff is True,
+    files with unrecognized extensions are typed by their leading bytes.
+
+    If threads is greater than 1, subdirectories are scanned in parallel,
+    which helps on network filesystems. Results are then yielded in no
+    particular order. '''
+
+    logger = logging.getLogger( 'util.scan' )
+
+    if None != mimetypes_in:
+        mimetypes_in = frozenset( mimetypes_in )
+    scan_args = (mimetypes_in, include, exclude, sniff, recursive)
+
+    if not recursive or 1 >= threads:
+        pending = [path]
+        while pending:
+            dir_path = pending.pop()
+            try:
+                files_out, dirs_out = _scan_dir( dir_path, *scan_args )
+            except OSError as exc:
+                if dir_path == path:
+                    raise
+                logger.warn( 'Unable to scan {}: {}'.format( dir_path, exc ) )
+                continue
+            for file_path in files_out:
+                yield file_path
+            if recursive:
+                # Reversed so subdirectories are visited in listing order.
+                pending.extend( reversed( dirs_out ) )
+        return
+
+    dir_queue = Queue.Queue()
+    out_queue = Queue.Queue( SCAN_QUEUE_MAX )
+    stop = threading.Event()
+    workers = []
+    for i in range( threads ):
+        worker = threading.Thread(
+            target=_scan_worker,
+            args=(dir_queue, out_queue, stop, scan_args)
+        )
+        worker.daemon = True
+        worker.start()
+        workers.append( worker )
+
+    try:
+        dir_queue.put( path )
+        dirs_pending = 1
+        while 0 < dirs_pending:
+            dir_path, files_out, dirs_out, exc = out_queue.get()
+            dirs_pending += len( dirs_out ) - 1
+            if None != exc:
+                if dir_path == path:
+                    raise exc
+                logger.warn( 'Unable to scan {}: {}'.format( dir_path, exc ) )
+            for file_path in files_out:
+                yield file_path
+    finally:
+        stop.set()
+        for worker in workers:
+            dir_queue.put( None )
+
 def listdir_mime( path, mimetypes_in ):
-    entries_out = []
-    for entry in os.listdir( path ):
-        if mimetypes.guess_type( entry )[0] in mimetypes_in:
-            entries_out.append( entry )
-    return entries_out
+
+    ''' Return the names of entries in path whose MIME type is in
+    mimetypes_in. See scan_mime() for large or recursive listings. '''
+
+    return [os.path.basename( entry ) for entry in
+        scan_mime( path, mimetypes_in, recursive=False )]
 
 def get_process_pid( process_name, strict=True, uid=None ):
     # Build the args list.
@@ -77,12 +386,12 @@ def get_process_pid( process_name, strict=True, uid=None ):
         
     # Get a list of processes matching the name.
     command = ['pgrep'] + args + ['^{}$'.format( process_name )]
-    kill_proc = subprocess.Popen( command, stdout=subprocess.PIPE )
+    pgrep_result = runner.run( command, timeout=PGREP_TIMEOUT )
 
     # Iterate through all found PID.
     pids_out = []
-    while True:
-        pid_kill = kill_proc.stdout.readline().rstrip()
+    for pid_kill in pgrep_result.stdout.splitlines():
+        pid_kill = pid_kill.rstrip()
         if pid_kill.isdigit():
             pids_out.append( pid_kill )
         else:
@@ -112,6 +421,31 @@ def _create_fs_lock( fs_mount_path, lock_type, perm='' ):
         with open( pid_lock_path, 'w' ) as pid_lock_file:
             pid_lock_file.write( '{}:{}'.format( fs_mount_path, perm ) )
 
+def _remove_fs_lock( fs_mount_path, lock_type ):
+
+    ''' Drop this process's lock entries for fs_mount_path, removing the lock
+    file altogether once nothing is left in it. '''
+
+    if LOCK_TYPE_REMOUNT == lock_type:
+        lock_dir = FS_REMOUNT_LOCK_PATH
+    elif LOCK_TYPE_MOUNT == lock_type:
+        lock_dir = FS_MOUNT_LOCK_PATH
+
+    pid_lock_path = os.path.join( lock_dir, str( os.getpid() ) )
+    try:
+        with open( pid_lock_path ) as pid_lock_file:
+            fs_lines = pid_lock_file.read().splitlines()
+    except IOError:
+        return
+
+    fs_lines = [l for l in fs_lines \
+        if l.strip() and l.strip().split( ':' )[0] != fs_mount_path]
+    if fs_lines:
+        with open( pid_lock_path, 'w' ) as pid_lock_file:
+            pid_lock_file.write( '\n'.join( fs_lines ) )
+    else:
+        os.unlink( pid_lock_path )
+
 def _check_fs_lock( fs_mount_path, lock_type, perm='' ):
 
     ''' Make sure no other ifdy processes are still using the given mount.
@@ -167,40 +501,162 @@ def _check_fs_lock( fs_mount_path, lock_type, perm='' ):
     # No locks found.
     return True
 
+def _get_libc():
+
+    ''' Return a handle to the C library with mount(2) prototyped, or None if
+    it is not available. '''
+
+    global _libc
+
+    if None == _libc:
+        try:
+            libc = ctypes.CDLL( ctypes.util.find_library( 'c' ), use_errno=True )
+            libc.mount.argtypes = [
+                ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                ctypes.c_ulong, ctypes.c_void_p
+            ]
+            libc.mount.restype = ctypes.c_int
+            _libc = libc
+        except (OSError, AttributeError):
+            _libc = False
+
+    return _libc or None
+
+def _mount_options( mount_path ):
+
+    ''' Return the list of options mount_path is currently mounted with, or
+    None if it is not mounted. '''
+
+    options = None
+    with open( PROC_MOUNTS_PATH, 'r' ) as mounts_file:
+        for line_iter in mounts_file:
+            line_array = line_iter.strip().split( ' ' )
+            # Keep going so the topmost of any stacked mounts wins.
+            if line_array[1] == mount_path:
+                options = line_array[3].split( ',' )
+    return options
+
+def _remount_syscall( fs_mount_path, perm ):
+
+    ''' Remount fs_mount_path with perm using mount(2). Return True on success
+    or False if the caller should fall back to the mount binary. '''
+
+    logger = logging.getLogger( 'util.remount' )
+
+    libc = _get_libc()
+    if None == libc:
+        return False
+
+    try:
+        options = _mount_options( fs_mount_path )
+    except IOError:
+        return False
+    if None == options:
+        return False
+
+    # A remount replaces the per-mount flags, so start from the current ones.
+    flags = MS_REMOUNT
+    for option in options:
+        flags |= FS_MOUNT_FLAGS.get( option, 0 )
+    if perm in FS_MOUNT_FLAGS:
+        flags |= FS_MOUNT_FLAGS[perm]
+    else:
+        flags &= ~FS_MOUNT_FLAGS[FS_ATTRIBS_OPPOSITE[perm]]
+
+    if 0 != libc.mount( None, fs_mount_path, None, flags, None ):
+        err = ctypes.get_errno()
+        logger.debug( 'mount(2) failed for "{}": {}'.format(
+            fs_mount_path, os.strerror( err )
+        ) )
+        return False
+
+    return True
+
+def _remount_fs( fs_mount_path, perm ):
+
+    ''' Perform the actual remount, preferring the syscall. '''
+
+    if FS_REMOUNT_SYSCALL and _remount_syscall( fs_mount_path, perm ):
+        return
+
+    # Perform the remount and verify its success.
+    mount_result = runner.run(
+        ['mount', '-o', 'remount,' + perm, fs_mount_path],
+        timeout=MOUNT_TIMEOUT
+    )
+    if mount_result.returncode:
+        raise RemountException( 'Mount process failed: {}'.format(
+            mount_result.stderr.strip()
+        ) )
+
+def _remount_restore( fs_mount_path, perm ):
+
+    ''' Drop all references to the given remount and put the filesystem back
+    the way it was. '''
+
+    logger = logging.getLogger( 'util.remount' )
+
+    if 0 >= _remount_refs.pop( (fs_mount_path, perm), 0 ):
+        return
+
+    # Leave the filesystem alone if someone else still needs it this way, but
+    # either way this process no longer holds it.
+    restore_perm = FS_ATTRIBS_OPPOSITE[perm]
+    try:
+        if _check_fs_lock( fs_mount_path, LOCK_TYPE_REMOUNT, perm=restore_perm ):
+            logger.info( 'Remounting "{}" with "{}".'.format(
+                fs_mount_path, restore_perm
+            ) )
+            _remount_fs( fs_mount_path, restore_perm )
+    finally:
+        _remove_fs_lock( fs_mount_path, LOCK_TYPE_REMOUNT )
+
 def remount( fs_mount_path, perm, register_cleanup=True ):
 
+    ''' Remount fs_mount_path with perm. If register_cleanup is True, the
+    remount is reference counted: nested requests for the same path and perm
+    share one remount, which is undone by release_remount() or at exit. '''
+
     logger = logging.getLogger( 'util.remount' )
 
     if not perm in FS_ATTRIBS_OPPOSITE.keys():
         raise RemountException( 'Unsupported perms: "{}"'.format( perm ) )
 
+    ref_key = (fs_mount_path, perm)
+    if register_cleanup and 0 < _remount_refs.get( ref_key, 0 ):
+        # Already remounted by this process, so just take another reference.
+        _remount_refs[ref_key] += 1
+        return
+
     if _check_fs_lock( fs_mount_path, LOCK_TYPE_REMOUNT, perm=perm ):
         logger.info( 'Remounting "{}" with "{}".'.format( fs_mount_path, perm ) )
 
         # Create lock for this mount.
         _create_fs_lock( fs_mount_path, LOCK_TYPE_REMOUNT, perm=perm )
 
-        # Perform the remount and verify its success.
-        mount_proc = subprocess.Popen(
-            ['mount', '-o', 'remount,' + perm, fs_mount_path]
-        )
-        mount_proc.communicate()
-        if mount_proc.returncode:
-            raise RemountException( 'Mount process failed.' )
-        #else:
-        #    logger.debug( 'Remount completed successfully.' )
+        _remount_fs( fs_mount_path, perm )
 
         # Schedule automatic remount with opposite FS attrib for script exit.
         if register_cleanup:
-            atexit.register(
-                remount, fs_mount_path, FS_ATTRIBS_OPPOSITE[perm], False
-            )
+            _remount_refs[ref_key] = 1
+            atexit.register( _remount_restore, fs_mount_path, perm )
+
+def release_remount( fs_mount_path, perm ):
+
+    ''' Release one reference taken by remount(). When the last reference is
+    released, the filesystem is remounted with the opposite of perm. '''
+
+    ref_key = (fs_mount_path, perm)
+    if 1 < _remount_refs.get( ref_key, 0 ):
+        _remount_refs[ref_key] -= 1
+    else:
+        _remount_restore( fs_mount_path, perm )
 
 def _mount_check( mount_path ):
     
     ''' Check that mount_path is not already mounted. '''
 
-    with open( '/proc/mounts', 'r' ) as mounts_file:
+    with open( PROC_MOUNTS_PATH, 'r' ) as mounts_file:
         for line_iter in mounts_file:
             line_array = line_iter.strip().split( ' ' )
             if line_array[1] == mount_path:
@@ -211,7 +667,7 @@ def mount_crypt(
     block_path, map_name, mount_path, key_path, register_cleanup=True
 ):
 
-    map_path = '/dev/mapper/{}'.format( map_name )
+    map_path = os.path.join( CRYPT_MAPPER_PATH, map_name )
 
     if not os.path.exists( key_path ):
         raise CryptException( 'Could not locate key file: {}'.format( key_path ) )
@@ -240,21 +696,13 @@ def mount_crypt(
     crypt_command = \
         ['cryptsetup', 'luksOpen', block_path, '--key-file', key_path, map_name];
 
-    crypt_proc = subprocess.Popen(
-        crypt_command,
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    crypt_proc.communicate()
+    crypt_result = runner.run( crypt_command, timeout=CRYPT_TIMEOUT )
 
-    if crypt_proc.returncode:
+    if crypt_result.returncode:
         # Try it read-only.
         crypt_command.insert( 2, '--readonly' )
-        crypt_proc = subprocess.Popen(
-            crypt_command,
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
-        crypt_proc.communicate()
-        if crypt_proc.returncode:
+        crypt_result = runner.run( crypt_command, timeout=CRYPT_TIMEOUT )
+        if crypt_result.returncode:
             raise CryptException(
                 'Could not open crypt volume: {}'.format( block_path )
             )
@@ -264,12 +712,10 @@ def mount_crypt(
         raise CryptException( 'Mapper file not created: {}'.format( map_path ) )
 
     # Mount secforce if it's not already mounted.
-    mount_proc = subprocess.Popen(
-        ['mount', map_path, mount_path],
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    mount_result = runner.run(
+        ['mount', map_path, mount_path], timeout=MOUNT_TIMEOUT
     )
-    mount_proc.communicate()
-    if mount_proc.returncode:
+    if mount_result.returncode:
         raise MountException( 'Could not mount: {}'.format( mount_path ) )
 
 def umount_crypt( map_name, mount_path ):
@@ -277,12 +723,10 @@ def umount_crypt( map_name, mount_path ):
 
         # Make sure it's actually mounted before trying to unmount.
         if _mount_check( mount_path ):
-            mount_proc = subprocess.Popen(
-                ['umount', mount_path],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE
+            mount_result = runner.run(
+                ['umount', mount_path], timeout=MOUNT_TIMEOUT
             )
-            mount_proc.communicate()
-            if mount_proc.returncode:
+            if mount_result.returncode:
                 raise MountException( 'Could not unmount: {}'.format( mount_path ) )
 
         # Don't make sure the device is mapped before trying to unmap because
@@ -290,14 +734,11 @@ def umount_crypt( map_name, mount_path ):
         # it until it goes.
         unmap_result = 1
         crypt_unmap_tries = 0
-        map_path = '/dev/mapper/{}'.format( map_name )
+        map_path = os.path.join( CRYPT_MAPPER_PATH, map_name )
         while crypt_unmap_tries < CRYPT_UNMAP_TRIES_MAX and unmap_result:
-            crypt_proc = subprocess.Popen(
-                ['cryptsetup', 'luksClose', map_name],
-                stdout=subprocess.PIPE, stderr=subprocess.PIPE
-            )
-            crypt_proc.communicate()
-            unmap_result = crypt_proc.returncode
+            unmap_result = runner.run(
+                ['cryptsetup', 'luksClose', map_name], timeout=CRYPT_TIMEOUT
+            ).returncode
             crypt_unmap_tries += 1
             if unmap_result:
                 # Try sleeping for a little.
@@ -306,33 +747,201 @@ def umount_crypt( map_name, mount_path ):
         if unmap_result and os.path.exists( map_path ):
             raise CryptException( 'Could not close map: {}'.format( map_name ) )
 
-def create_lock( lock_path ):
+class FileLock( object ):
 
-    ''' Create a lock file containing the PID of the current process. '''
+    ''' An flock()-based lock on lock_path. Exclusive locks record the PID of
+    the holder in the file. Any number of processes may hold a shared lock at
+    once. The kernel drops the lock if the holding process dies.
 
-    if not os.path.isfile( lock_path ):
-        with open( lock_path, 'w' ) as pid_file:
-            pid_file.write( '{}'.format( os.getpid() ) )
-    else:
-        # TODO: If lock_path exists, add our pid to it.
-        pass
+    Can be used as a context manager, in which case failing to acquire the lock
+    within timeout raises LockException. '''
 
-def check_lock( lock_path, unlink_old=True ):
+    def __init__( self, lock_path, shared=False, timeout=None ):
+        self.lock_path = lock_path
+        self.shared = shared
+        self.timeout = timeout
+        self._fd = None
+
+    def _open( self ):
+        fd = os.open( self.lock_path, os.O_RDWR | os.O_CREAT, 0644 )
+
+        # Don't let child processes inherit (and so outlive us holding) the
+        # lock.
+        flags = fcntl.fcntl( fd, fcntl.F_GETFD )
+        fcntl.fcntl( fd, fcntl.F_SETFD, flags | fcntl.FD_CLOEXEC )
+
+        return fd
+
+    def _wait_alarm( self, fd, mode, timeout ):
+
+        ''' Block on the lock, cut short by SIGALRM after timeout seconds. '''
+
+        def expire( signum, frame ):
+            raise _LockTimeout()
+
+        acquired = False
+        previous = signal.signal( signal.SIGALRM, expire )
+        try:
+            try:
+                signal.setitimer( signal.ITIMER_REAL, timeout )
+                fcntl.flock( fd, mode )
+                acquired = True
+            finally:
+                signal.setitimer( signal.ITIMER_REAL, 0 )
+        except _LockTimeout:
+            pass
+        finally:
+            signal.signal( signal.SIGALRM, previous )
+
+        return acquired
 
-    ''' Make sure the existing lock file (if any) doesn't point to a running
-    process. Return true if it does, false if it doesn't. '''
+    def _wait_retry( self, fd, mode, timeout ):
 
-    if os.access( lock_path, os.F_OK ):
-        with open( lock_path, 'r' ) as pid_file:
-            
-            # TODO: Iterate through *all* pids in the lock file.
+        ''' Retry the lock with backoff for up to timeout seconds. '''
 
-            pid_file.seek( 0 )
-            existing_pid = pid_file.readline()
-            if os.path.exists( '/proc/{}'.format( existing_pid ) ):
+        deadline = time.time() + timeout
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock( fd, mode | fcntl.LOCK_NB )
                 return True
-            else:
-                if unlink_old:
-                    os.unlink( lock_path )
+            except IOError as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+            remaining = deadline - time.time()
+            if 0 >= remaining:
                 return False
+            time.sleep( min( delay, remaining ) )
+            delay = min( delay * 2, LOCK_RETRY_MAX )
 
+    def _wait( self, fd, mode, timeout ):
+
+        ''' Wait up to timeout seconds for the lock on fd. Return True if it
+        was acquired. Nothing is left waiting on fd once this returns. '''
+
+        # Only the main thread gets signals, and only use the timer if nobody
+        # else is.
+        if isinstance( threading.current_thread(), threading._MainThread ) and \
+        signal.SIG_DFL == signal.getsignal( signal.SIGALRM ) and \
+        0 == signal.getitimer( signal.ITIMER_REAL )[0]:
+            return self._wait_alarm( fd, mode, timeout )
+        return self._wait_retry( fd, mode, timeout )
+
+    def acquire( self, blocking=True, timeout=None ):
+
+        ''' Acquire the lock. If blocking is False or timeout is 0, return
+        immediately. Otherwise wait up to timeout seconds (forever if None).
+        Return True if the lock was acquired. '''
+
+        if None != self._fd:
+            raise LockException( 'Lock already held: {}'.format(
+                self.lock_path
+            ) )
+
+        if self.shared:
+            mode = fcntl.LOCK_SH
+        else:
+            mode = fcntl.LOCK_EX
+
+        fd = self._open()
+        try:
+            try:
+                fcntl.flock( fd, mode | fcntl.LOCK_NB )
+            except IOError as exc:
+                if exc.errno not in (errno.EAGAIN, errno.EACCES):
+                    raise
+                if not blocking or 0 == timeout:
+                    os.close( fd )
+                    return False
+                elif None == timeout:
+                    fcntl.flock( fd, mode )
+                elif not self._wait( fd, mode, timeout ):
+                    os.close( fd )
+                    return False
+        except:
+            os.close( fd )
+            raise
+
+        self._fd = fd
+
+        if not self.shared:
+            os.ftruncate( fd, 0 )
+            os.write( fd, '{}'.format( os.getpid() ) )
+
+        return True
+
+    def release( self ):
+        if None != self._fd:
+            fcntl.flock( self._fd, fcntl.LOCK_UN )
+            os.close( self._fd )
+            self._fd = None
+
+    def locked( self ):
+
+        ''' Return True if this object currently holds the lock. '''
+
+        return None != self._fd
+
+    def __enter__( self ):
+        if not self.acquire( timeout=self.timeout ):
+            raise LockException( 'Timed out waiting for lock: {}'.format(
+                self.lock_path
+            ) )
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        self.release()
+
+def create_lock( lock_path, shared=False, timeout=0 ):
+
+    ''' Take a FileLock on lock_path for the rest of the life of the current
+    process. Shared holders append their PIDs to the file. Return True if the
+    lock was acquired. '''
+
+    if lock_path in _held_locks:
+        return True
+
+    lock = FileLock( lock_path, shared=shared )
+    if not lock.acquire( timeout=timeout ):
+        return False
+
+    if shared:
+        with open( lock_path, 'a' ) as pid_file:
+            pid_file.write( '{}\n'.format( os.getpid() ) )
+
+    _held_locks[lock_path] = lock
+    return True
+
+def check_lock( lock_path, unlink_old=True ):
+
+    ''' Make sure the existing lock file (if any) isn't held by a running
+    process. Return true if it is, false if it isn't.
+
+    If unlink_old is True, the PIDs left in a stale lock file are cleared. The
+    file itself is kept, as another process may already be waiting on it. '''
+
+    if not os.access( lock_path, os.F_OK ):
+        return False
+
+    probe = FileLock( lock_path )
+    try:
+        fd = probe._open()
+    except OSError as exc:
+        if errno.ENOENT == exc.errno:
+            return False
+        raise
+
+    try:
+        fcntl.flock( fd, fcntl.LOCK_EX | fcntl.LOCK_NB )
+    except IOError as exc:
+        if exc.errno not in (errno.EAGAIN, errno.EACCES):
+            raise
+        os.close( fd )
+        return True
+
+    # Nobody holds it, so it's stale.
+    if unlink_old:
+        os.ftruncate( fd, 0 )
+    fcntl.flock( fd, fcntl.LOCK_UN )
+    os.close( fd )
+    return False
@@ -17,29 +17,169 @@ You should have received a copy of the GNU Lesser General Public License along
 with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-import pynotify
 import subprocess
 import os
 import file
+import time
+import atexit
+import threading
+import logging
 
 DESKTOP_ENVS = ['awesome']
 
+# Seconds to trust the last desktop_up() answer for.
+DESKTOP_CACHE_SECS = 30
+
+# Shortest gap in seconds between notifications. Messages arriving faster are
+# rolled up into one.
+NOTIFY_INTERVAL = 1.0
+
+# Most messages held back while waiting to send. Older ones beyond this are
+# only counted in the summary.
+NOTIFY_PENDING_MAX = 100
+
+NOTIFY_APP_NAME = 'qn-script'
+NOTIFY_TITLE = 'Script'
+
+_desktop_cache = {'time': 0, 'up': None}
+
+_notifier = None
+_notifier_lock = threading.Lock()
+
+class NotifyException( Exception ):
+    pass
+
+class Notifier( object ):
+
+    ''' A desktop notifier that initializes once and updates a single
+    notification in place. Messages are sent from a background thread, so
+    notify() never blocks, and bursts are coalesced into one summary at most
+    every interval seconds. '''
+
+    def __init__( self, app_name=NOTIFY_APP_NAME, interval=NOTIFY_INTERVAL ):
+        # Set up here so failures reach the caller, not the sending thread.
+        import pynotify
+        pynotify.init( app_name )
+
+        self.app_name = app_name
+        self.interval = interval
+        self._pynotify = pynotify
+        self._pending = []
+        self._dropped = 0
+        self._cond = threading.Condition()
+        self._closed = False
+        self._notice = None
+        self._thread = threading.Thread( target=self._send_loop )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def notify( self, message, title=None ):
+        if None == title:
+            title = NOTIFY_TITLE
+        with self._cond:
+            if self._closed:
+                return
+            if not self._thread.is_alive():
+                raise NotifyException( 'Notification thread has stopped.' )
+            if NOTIFY_PENDING_MAX <= len( self._pending ):
+                self._pending.pop( 0 )
+                self._dropped += 1
+            self._pending.append( (title, message) )
+            self._cond.notify()
+
+    def _summarize( self, pending, dropped=0 ):
+
+        ''' Roll a burst of messages up into one (title, message). '''
+
+        title, message = pending[-1]
+        more = len( pending ) - 1 + dropped
+        if 0 < more:
+            message = '{}\n(+{} more)'.format( message, more )
+        return title, message
+
+    def _show( self, title, message ):
+        if None != self._notice:
+            try:
+                self._notice.update( title, message )
+                self._notice.show()
+                return
+            except Exception:
+                # Server doesn't want it back; start a new one.
+                self._notice = None
+        self._notice = self._pynotify.Notification( title, message )
+        self._notice.show()
+
+    def _send_loop( self ):
+        logger = logging.getLogger( 'ifdyutil.gui.notify' )
+
+        last_sent = 0
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+
+                # Let a burst build up before sending it, unless closing.
+                while not self._closed:
+                    wait = last_sent + self.interval - time.time()
+                    if 0 >= wait:
+                        break
+                    self._cond.wait( wait )
+
+                pending = self._pending
+                dropped = self._dropped
+                self._pending = []
+                self._dropped = 0
+
+            try:
+                self._show( *self._summarize( pending, dropped ) )
+            except Exception as exc:
+                logger.warning( 'Unable to show notification: {}'.format(
+                    exc
+                ) )
+            last_sent = time.time()
+
+    def close( self ):
+
+        ''' Send anything still pending and stop the sending thread. '''
+
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+def _get_notifier():
+    global _notifier
+
+    with _notifier_lock:
+        if None == _notifier:
+            _notifier = Notifier()
+            atexit.register( _notifier.close )
+        return _notifier
+
 def notify( message, title=None ):
-    if title is None:
-        title = "Script"
-    else:
-        title = title
-    pynotify.init( "qn-script" )
-    notice = pynotify.Notification( title, message )
-    notice.show()
+
+    ''' Show a desktop notification without waiting for it. '''
+
+    _get_notifier().notify( message, title )
 
 def desktop_up():
 
-    ''' Return true if a known graphical desktop environment is running. '''
+    ''' Return true if a known graphical desktop environment is running. The
+    answer is cached for DESKTOP_CACHE_SECS. '''
+
+    now = time.time()
+    if None != _desktop_cache['up'] and \
+    now - _desktop_cache['time'] < DESKTOP_CACHE_SECS:
+        return _desktop_cache['up']
 
+    up = False
     for env in DESKTOP_ENVS:
         if [] != file.get_process_pid( env, strict=False, uid=str(os.geteuid()) ):
-            return True
+            up = True
+            break
 
-    return False
-        
+    _desktop_cache['time'] = now
+    _desktop_cache['up'] = up
+    return up
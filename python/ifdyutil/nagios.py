@@ -22,21 +22,486 @@ CRITICAL = 2
 WARNING = 1
 OK = 0
 
+STATUS_NAMES = {
+    OK: 'OK',
+    WARNING: 'WARNING',
+    CRITICAL: 'CRITICAL',
+    UNKNOWN: 'UNKNOWN',
+}
+
+# Order of statuses from best to worst when summarizing many results.
+STATUS_SEVERITY = [OK, UNKNOWN, WARNING, CRITICAL]
+
+NAGIOS_COMMAND_FILE = '/var/lib/nagios3/rw/nagios.cmd'
+
 import sys
+import os
+import re
+import errno
+import fcntl
+import time
+import tempfile
+import threading
+import heapq
+import imp
+import glob
+import Queue
+import logging
+import argparse
+
+# Writes to the command pipe no larger than this can't be interleaved with
+# those of other processes.
+PIPE_BUF = 4096
+
+CHECK_INTERVAL = 60
+CHECK_THREADS = 4
+
+# Most seconds the runner sleeps between passive batch flushes.
+RUNNER_TICK = 1.0
+
+# Set while a check runs inside a CheckRunner, so exiting doesn't print.
+_runner_state = threading.local()
+
+class CheckExit( SystemExit ):
+
+    ''' Raised by CheckResult.exit(). Outside a CheckRunner this behaves
+    exactly like sys.exit( status ). '''
+
+    def __init__( self, result ):
+        SystemExit.__init__( self, result.status )
+        self.result = result
+
+class CheckResult( object ):
+
+    ''' The result of a service (or host, if service is None) check, with
+    optional performance data and extra lines of long output. '''
+
+    def __init__( self, status=OK, message='', host=None, service=None ):
+        self.status = status
+        self.message = message
+        self.host = host
+        self.service = service
+        self.long_output = []
+        self.perfdata = []
+        self.time = time.time()
+
+    def add_line( self, line ):
+        self.long_output.append( line )
+
+    def add_perfdata(
+        self, label, value, uom='', warn=None, crit=None, minimum=None,
+        maximum=None
+    ):
+
+        ''' Add a performance data item in the form of
+        label=value[uom];warn;crit;min;max '''
+
+        if re.search( r"[\s='|]", label ):
+            label = "'{}'".format( label.replace( "'", "''" ) )
+
+        fields = ['{}{}'.format( value, uom )]
+        for threshold in (warn, crit, minimum, maximum):
+            fields.append( '' if None == threshold else str( threshold ) )
+
+        self.perfdata.append( '{}={}'.format(
+            label, ';'.join( fields ).rstrip( ';' )
+        ) )
+
+    def output( self ):
+
+        ''' Return the plugin output for this result. '''
+
+        lines = ['{} - {}'.format(
+            STATUS_NAMES.get( self.status, 'UNKNOWN' ), self.message
+        )]
+        if self.perfdata:
+            lines[0] += ' | ' + ' '.join( self.perfdata )
+        return '\n'.join( lines + self.long_output )
+
+    def exit( self ):
+        if not getattr( _runner_state, 'active', False ):
+            print( self.output() )
+        raise CheckExit( self )
 
 def exit_unknown( message ):
-    print( 'UNKNOWN - {}'.format( message ) )
-    sys.exit( UNKNOWN )
+    CheckResult( UNKNOWN, message ).exit()
 
 def exit_critical( message ):
-    print( 'CRITICAL - {}'.format( message ) )
-    sys.exit( CRITICAL )
+    CheckResult( CRITICAL, message ).exit()
 
 def exit_warning( message ):
-    print( 'WARNING - {}'.format( message ) )
-    sys.exit( WARNING )
+    CheckResult( WARNING, message ).exit()
 
 def exit_ok( message ):
-    print( 'OK - {}'.format( message ) )
-    sys.exit( OK )
+    CheckResult( OK, message ).exit()
+
+class PassiveBatch( object ):
+
+    ''' Collect many check results and submit them to Nagios together, either
+    through the external command file or as one check result file dropped in
+    spool_dir (the checkresults directory) if given. '''
+
+    def __init__( self, command_file=NAGIOS_COMMAND_FILE, spool_dir=None ):
+        self.command_file = command_file
+        self.spool_dir = spool_dir
+        self.results = []
+
+    def add( self, result ):
+        if None == result.host:
+            raise ValueError( 'Passive results need a host.' )
+        self.results.append( result )
+
+    def _command_line( self, result ):
+        output = result.output().replace( '\n', '\\n' )
+        if None == result.service:
+            return '[{}] PROCESS_HOST_CHECK_RESULT;{};{};{}\n'.format(
+                int( result.time ), result.host, result.status, output
+            )
+        return '[{}] PROCESS_SERVICE_CHECK_RESULT;{};{};{};{}\n'.format(
+            int( result.time ), result.host, result.service, result.status,
+            output
+        )
+
+    def _write_command_file( self ):
+
+        # Pack whole lines into as few writes as possible, none of them big
+        # enough to be split up by the pipe.
+        writes = ['']
+        for result in self.results:
+            line = self._command_line( result )
+            if PIPE_BUF < len( writes[-1] ) + len( line ):
+                writes.append( '' )
+            writes[-1] += line
+
+        # Opening the command pipe for writing blocks until Nagios opens it
+        # for reading, so don't wait: with no reader this fails with ENXIO.
+        try:
+            fd = os.open(
+                self.command_file, os.O_WRONLY | os.O_APPEND | os.O_NONBLOCK
+            )
+        except OSError as exc:
+            if errno.ENXIO == exc.errno:
+                raise IOError( exc.errno, 'Nagios is not reading {}'.format(
+                    self.command_file
+                ) )
+            raise
+        try:
+            # Blocking writes keep each one whole.
+            flags = fcntl.fcntl( fd, fcntl.F_GETFL )
+            fcntl.fcntl( fd, fcntl.F_SETFL, flags & ~os.O_NONBLOCK )
+            for data in writes:
+                if data:
+                    os.write( fd, data )
+        finally:
+            os.close( fd )
+
+    def _write_spool( self ):
+        now = time.time()
+        entries = ['### Passive Check Result File ###\nfile_time={}\n'.format(
+            int( now )
+        )]
+        for result in self.results:
+            entry = '\n### Nagios {} Check Result ###\n'.format(
+                'Host' if None == result.service else 'Service'
+            )
+            entry += '# Time: {}\n'.format( time.ctime( result.time ) )
+            entry += 'host_name={}\n'.format( result.host )
+            if None != result.service:
+                entry += 'service_description={}\n'.format( result.service )
+            entry += 'check_type=1\ncheck_options=0\nscheduled_check=0\n'
+            entry += 'reschedule_check=0\nlatency=0.0\n'
+            entry += 'start_time={0:.6f}\nfinish_time={0:.6f}\n'.format(
+                result.time
+            )
+            entry += 'early_timeout=0\nexited_ok=1\n'
+            entry += 'return_code={}\n'.format( result.status )
+            entry += 'output={}\n'.format(
+                result.output().replace( '\n', '\\n' )
+            )
+            entries.append( entry )
+
+        # Nagios only picks up files named c + 6 characters, and only once
+        # their .ok marker exists.
+        fd, spool_path = tempfile.mkstemp( prefix='c', dir=self.spool_dir )
+        try:
+            os.write( fd, ''.join( entries ) )
+        finally:
+            os.close( fd )
+        os.chmod( spool_path, 0644 )
+        open( spool_path + '.ok', 'w' ).close()
+
+        return spool_path
+
+    def flush( self ):
+
+        ''' Submit all collected results and clear the batch. '''
+
+        if not self.results:
+            return
+        if None != self.spool_dir:
+            self._write_spool()
+        else:
+            self._write_command_file()
+        self.results = []
+
+def worst_status( results ):
+
+    ''' Return the most severe status among the given results. '''
+
+    status = OK
+    for result in results:
+        if STATUS_SEVERITY.index( result.status ) > \
+        STATUS_SEVERITY.index( status ):
+            status = result.status
+    return status
+
+class CheckRunner( object ):
+
+    ''' Run check functions in-process on a pool of threads, so many checks
+    share one interpreter instead of starting one each.
+
+    Check functions take no arguments beyond those given to add_check() and
+    return a CheckResult. Older checks that call exit_ok() etc. work too. Each
+    result is passed to on_result if given, and to batch (a PassiveBatch) if
+    given, which is flushed as results come in. '''
+
+    def __init__( self, threads=CHECK_THREADS, batch=None, on_result=None ):
+        self.threads = threads
+        self.batch = batch
+        self.on_result = on_result
+        self.checks = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def add_check(
+        self, function, interval=CHECK_INTERVAL, host=None, service=None,
+        args=()
+    ):
+        if None == service:
+            service = function.__name__
+        self.checks.append( {
+            'function': function,
+            'interval': interval,
+            'host': host,
+            'service': service,
+            'args': args,
+            'running': False,
+        } )
+
+    def load_plugin( self, plugin_path ):
+
+        ''' Import the check plugin at plugin_path and let it add its checks
+        by calling its register( runner ) function. '''
+
+        plugin_name = os.path.splitext( os.path.basename( plugin_path ) )[0]
+        plugin = imp.load_source(
+            'ifdyutil_check_{}'.format( plugin_name ), plugin_path
+        )
+        plugin.register( self )
+
+    def load_plugins( self, plugin_dir ):
+        for plugin_path in sorted( glob.glob(
+            os.path.join( plugin_dir, '*.py' )
+        ) ):
+            self.load_plugin( plugin_path )
+
+    def run_check( self, check ):
+
+        ''' Run a single check and return its CheckResult. '''
+
+        logger = logging.getLogger( 'ifdyutil.nagios.runner' )
+
+        _runner_state.active = True
+        try:
+            result = check['function']( *check['args'] )
+        except CheckExit as exc:
+            result = exc.result
+        except SystemExit as exc:
+            # Map sys.exit() codes the way a shell would see them.
+            if None == exc.code or 0 == exc.code:
+                result = CheckResult( OK, 'Check exited.' )
+            elif isinstance( exc.code, basestring ):
+                result = CheckResult( UNKNOWN, exc.code )
+            elif exc.code in STATUS_SEVERITY:
+                result = CheckResult( exc.code, 'Check exited.' )
+            else:
+                result = CheckResult( UNKNOWN, 'Check exited with {}.'.format(
+                    exc.code
+                ) )
+        except Exception as exc:
+            logger.exception( 'Check {} failed.'.format( check['service'] ) )
+            result = CheckResult( UNKNOWN, 'Check raised {}: {}'.format(
+                type( exc ).__name__, exc
+            ) )
+        finally:
+            _runner_state.active = False
+
+        if not isinstance( result, CheckResult ):
+            result = CheckResult( UNKNOWN, 'Check returned no result.' )
+        if None == result.host:
+            result.host = check['host']
+        if None == result.service:
+            result.service = check['service']
+        return result
+
+    def _emit( self, result ):
+        with self._lock:
+            if None != self.on_result:
+                self.on_result( result )
+            if None != self.batch:
+                self.batch.add( result )
+
+    def _flush( self ):
+        logger = logging.getLogger( 'ifdyutil.nagios.runner' )
+
+        if None != self.batch:
+            with self._lock:
+                try:
+                    self.batch.flush()
+                except (IOError, OSError) as exc:
+                    # Nagios may just be down. Drop the batch rather than let
+                    # it grow, and carry on; fresh results will follow.
+                    logger.error( 'Unable to submit {} results: {}'.format(
+                        len( self.batch.results ), exc
+                    ) )
+                    self.batch.results = []
+
+    def _worker( self, work_queue ):
+        while True:
+            work = work_queue.get()
+            if None == work:
+                break
+            check, results, index = work
+            try:
+                result = self.run_check( check )
+                if None != results:
+                    results[index] = result
+                self._emit( result )
+            finally:
+                check['running'] = False
+
+    def _start_workers( self, work_queue ):
+        workers = []
+        for i in range( self.threads ):
+            worker = threading.Thread( target=self._worker, args=(work_queue,) )
+            worker.daemon = True
+            worker.start()
+            workers.append( worker )
+        return workers
+
+    def _stop_workers( self, work_queue, workers ):
+        for worker in workers:
+            work_queue.put( None )
+        for worker in workers:
+            worker.join()
+
+    def run_once( self ):
+
+        ''' Run every check once and return the results in check order. '''
+
+        results = [None] * len( self.checks )
+        work_queue = Queue.Queue()
+        for i, check in enumerate( self.checks ):
+            work_queue.put( (check, results, i) )
+
+        workers = self._start_workers( work_queue )
+        self._stop_workers( work_queue, workers )
+        self._flush()
+
+        return results
+
+    def run( self, duration=None ):
+
+        ''' Run each check every interval seconds until stop() is called or
+        duration seconds have passed. A check still running when it comes due
+        again is skipped that time around. '''
+
+        self._stop.clear()
+        work_queue = Queue.Queue()
+        workers = self._start_workers( work_queue )
+
+        time_start = time.time()
+        schedule = [(time_start, i, c) for i, c in enumerate( self.checks )]
+        heapq.heapify( schedule )
+
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                if None != duration and now - time_start >= duration:
+                    break
+
+                while schedule and schedule[0][0] <= now:
+                    due, i, check = heapq.heappop( schedule )
+                    if not check['running']:
+                        check['running'] = True
+                        work_queue.put( (check, None, None) )
+                    heapq.heappush(
+                        schedule, (max( due + check['interval'], now ), i, check)
+                    )
+
+                self._flush()
+
+                wait = RUNNER_TICK
+                if schedule:
+                    wait = min( wait, max( 0, schedule[0][0] - time.time() ) )
+                if None != duration:
+                    wait = min(
+                        wait, max( 0, time_start + duration - time.time() )
+                    )
+                self._stop.wait( wait )
+        finally:
+            self._stop_workers( work_queue, workers )
+            self._flush()
+
+    def stop( self ):
+        self._stop.set()
+
+def main( argv=None ):
+
+    ''' Command line interface to CheckRunner. '''
+
+    parser = argparse.ArgumentParser(
+        description='Run check plugins in one process.'
+    )
+    parser.add_argument(
+        'plugins', nargs='+',
+        help='Plugin files, or directories of them, defining register().'
+    )
+    parser.add_argument( '-j', '--threads', type=int, default=CHECK_THREADS )
+    parser.add_argument(
+        '-1', '--once', action='store_true',
+        help='Run each check once, print the results and exit with the worst '
+            'status.'
+    )
+    parser.add_argument( '-c', '--command-file', default=NAGIOS_COMMAND_FILE )
+    parser.add_argument(
+        '-s', '--spool-dir', default=None,
+        help='Submit passive results as check result files here instead of '
+            'through the command file.'
+    )
+    args = parser.parse_args( argv )
+
+    runner = CheckRunner( threads=args.threads )
+    for plugin_path in args.plugins:
+        if os.path.isdir( plugin_path ):
+            runner.load_plugins( plugin_path )
+        else:
+            runner.load_plugin( plugin_path )
+
+    if args.once:
+        results = runner.run_once()
+        for result in results:
+            print( result.output() )
+        return worst_status( results )
+
+    runner.batch = PassiveBatch(
+        command_file=args.command_file, spool_dir=args.spool_dir
+    )
+    try:
+        runner.run()
+    except KeyboardInterrupt:
+        pass
+    return OK
 
+if __name__ == '__main__':
+    sys.exit( main() )
@@ -18,22 +18,438 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import subprocess
+import os
+import sys
+import tempfile
+import threading
+import Queue
+import argparse
+import pipes
+import stat
+import runner
+import file
 
-def ssh_command_unsafe( remote_host, command ):
+# Seconds an idle pooled connection is kept open by its master.
+SSH_CONTROL_PERSIST = 300
+
+# Where pooled connection sockets live. %C is a hash of the connection details
+# so the path stays short enough for a socket.
+SSH_CONTROL_DIR = os.path.join(
+    tempfile.gettempdir(), 'ifdyutil-ssh-{}'.format( os.getuid() )
+)
+
+# Default number of hosts ssh_command_many() talks to at once.
+SSH_JOBS_MAX = 16
+
+# Chunks buffered between a producer and a remote upload before write() blocks.
+SSH_STREAM_QUEUE_MAX = 16
+
+class SSHException( Exception ):
+    pass
+
+def _ssh_join( command ):
+    if isinstance( command, list ):
+        # Iterate through the list and wrap it up.
+        return ' && '.join( command )
+    else:
+        return command
+
+def _ssh_control_args( persist=SSH_CONTROL_PERSIST ):
+
+    ''' Return the ssh options needed to share one multiplexed master
+    connection per host. '''
+
+    file.mkdir_p( SSH_CONTROL_DIR, 0700 )
+
+    # The default lives in a shared temp dir, so make sure nobody else got
+    # there first and can see or redirect our sockets.
+    control_stat = os.lstat( SSH_CONTROL_DIR )
+    if not stat.S_ISDIR( control_stat.st_mode ) or \
+    os.getuid() != control_stat.st_uid or \
+    0 != stat.S_IMODE( control_stat.st_mode ) & 0077:
+        raise SSHException( 'Unsafe control socket dir: {}'.format(
+            SSH_CONTROL_DIR
+        ) )
+
+    return [
+        '-o', 'ControlMaster=auto',
+        '-o', 'ControlPath={}'.format( os.path.join( SSH_CONTROL_DIR, '%C' ) ),
+        '-o', 'ControlPersist={}'.format( persist ),
+    ]
+
+def ssh_command_unsafe( remote_host, command, pooled=False ):
 
     ''' Execute the given command on a remote host via SSH. The command can be a
     string or it can be a list of strings that will be joined by && and
-    executed as one line.
+    executed as one line. If pooled is True, the command runs over a shared
+    connection (see ssh_command_pooled()). Return the exit code.
     
     This function is unsane, as its name implies. It should be fine if the
     remote server is resilient against arbitrary SSH commands, though. For
     example, if it's using public key command restriction.'''
     
-    if isinstance( command, list ):
-        # Iterate through the list and wrap it up.
-        command_exec = ' && '.join( command )
-    else:
-        command_exec = command
+    ssh_args = ['ssh']
+    if pooled:
+        ssh_args += _ssh_control_args()
+
+    return runner.run(
+        ssh_args + [remote_host, _ssh_join( command )], timeout=None,
+        capture=False
+    ).returncode
+
+def _ssh_run( ssh_args, timeout=None, stdout_cb=None, stderr_cb=None ):
+
+    ''' Run ssh with the given args, killing it after timeout seconds. Lines
+    of output are passed to the callbacks as they arrive. Return a result
+    dict. '''
+
+    with open( os.devnull ) as devnull:
+        ssh_result = runner.run(
+            ssh_args, timeout=timeout, stdin=devnull, stdout_cb=stdout_cb,
+            stderr_cb=stderr_cb
+        )
+
+    return {
+        'returncode': ssh_result.returncode,
+        'stdout': ssh_result.stdout,
+        'stderr': ssh_result.stderr,
+        'elapsed': ssh_result.elapsed,
+        'timed_out': ssh_result.timed_out,
+    }
+
+def ssh_command_pooled(
+    remote_host, command, persist=SSH_CONTROL_PERSIST, timeout=None
+):
+
+    ''' Execute the given command on a remote host like ssh_command_unsafe(),
+    but over a multiplexed connection that is kept open for persist seconds
+    after the last use. Later commands to the same host skip the connection
+    handshake. Return a tuple of (exit code, stdout, stderr). If timeout is
+    given, ssh is killed after that many seconds.
+
+    The same caveats as ssh_command_unsafe() apply. '''
+
+    result = _ssh_run(
+        ['ssh'] + _ssh_control_args( persist ) + \
+            [remote_host, _ssh_join( command )],
+        timeout=timeout
+    )
+
+    return (result['returncode'], result['stdout'], result['stderr'])
+
+def ssh_command_many(
+    remote_hosts, command, max_jobs=SSH_JOBS_MAX, timeout=None, pooled=True,
+    output=None
+):
+
+    ''' Execute the given command on every host in remote_hosts, talking to
+    up to max_jobs hosts at once and giving each one timeout seconds. If
+    output is a file, each line of output is written to it prefixed with its
+    host as it arrives.
+
+    Return a dict keyed by host of result dicts with returncode, stdout,
+    stderr, elapsed and timed_out keys.
+
+    The same caveats as ssh_command_unsafe() apply. '''
+
+    command_exec = _ssh_join( command )
+    ssh_base = ['ssh']
+    if pooled:
+        ssh_base += _ssh_control_args()
+
+    output_lock = threading.Lock()
+
+    def line_writer( remote_host ):
+        if None == output:
+            return None
+        def write_line( line ):
+            with output_lock:
+                output.write( '{}: {}'.format( remote_host, line ) )
+                if not line.endswith( '\n' ):
+                    output.write( '\n' )
+                output.flush()
+        return write_line
+
+    results = {}
+    host_queue = Queue.Queue()
+    for remote_host in remote_hosts:
+        host_queue.put( remote_host )
+
+    def worker():
+        while True:
+            try:
+                remote_host = host_queue.get_nowait()
+            except Queue.Empty:
+                return
+            write_line = line_writer( remote_host )
+            try:
+                results[remote_host] = _ssh_run(
+                    ssh_base + [remote_host, command_exec],
+                    timeout=timeout, stdout_cb=write_line, stderr_cb=write_line
+                )
+            except OSError as exc:
+                results[remote_host] = {
+                    'returncode': None,
+                    'stdout': '',
+                    'stderr': str( exc ),
+                    'elapsed': 0,
+                    'timed_out': False,
+                }
+
+    workers = []
+    for i in range( min( max_jobs, host_queue.qsize() ) ):
+        worker_thread = threading.Thread( target=worker )
+        worker_thread.start()
+        workers.append( worker_thread )
+    for worker_thread in workers:
+        worker_thread.join()
+
+    return results
+
+def ssh_close( remote_host ):
+
+    ''' Shut down the pooled connection to remote_host, if any. '''
+
+    return runner.run(
+        ['ssh'] + _ssh_control_args() + ['-O', 'exit', remote_host]
+    ).success
+
+class SSHUpload( object ):
+
+    ''' A writable file-like object that streams to remote_path on
+    remote_host over SSH. Up to queue_max chunks are buffered so the producer
+    can keep working while the network catches up. The data lands in
+    remote_path.part and is only renamed into place once the upload closes
+    cleanly. Use abort() to give up on it. '''
+
+    def __init__(
+        self, remote_host, remote_path, pooled=True,
+        queue_max=SSH_STREAM_QUEUE_MAX
+    ):
+        self.remote_host = remote_host
+        self.remote_path = remote_path
+        self.closed = False
+
+        self._ssh_args = ['ssh']
+        if pooled:
+            self._ssh_args += _ssh_control_args()
+
+        with open( os.devnull, 'w' ) as devnull:
+            self._proc, self._result = runner.spawn(
+                self._ssh_args + [remote_host, 'cat > {}'.format(
+                    pipes.quote( remote_path + '.part' )
+                )],
+                stdin=subprocess.PIPE, stdout=devnull, stderr=subprocess.PIPE
+            )
+
+        self._error = None
+        self._queue = Queue.Queue( queue_max )
+        self._writer = threading.Thread( target=self._write_loop )
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _write_loop( self ):
+        while True:
+            chunk = self._queue.get()
+            if None == chunk:
+                break
+            if None != self._error:
+                # Keep draining so write() doesn't block forever.
+                continue
+            try:
+                self._proc.stdin.write( chunk )
+            except IOError as exc:
+                self._error = exc
+
+    def write( self, data ):
+        if self.closed:
+            raise ValueError( 'Upload already closed.' )
+        if None != self._error:
+            raise IOError( 'Upload to {} failed: {}'.format(
+                self.remote_host, self._error
+            ) )
+        if data:
+            self._queue.put( data )
+
+    def flush( self ):
+        pass
+
+    def abort( self ):
+
+        ''' Give up on the upload, leaving remote_path untouched. '''
+
+        if not self.closed:
+            self.closed = True
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+            self._queue.put( None )
+            self._writer.join()
+            runner.finish( self._proc, self._result )
+
+    def close( self ):
+        if self.closed:
+            return
+        self.closed = True
+
+        self._queue.put( None )
+        self._writer.join()
+        try:
+            self._proc.stdin.close()
+        except IOError as exc:
+            self._error = self._error or exc
+        ssh_err = self._proc.stderr.read()
+        runner.finish( self._proc, self._result, ssh_err )
+        if self._result.success and None == self._error:
+            # A dropped connection can look like a clean end of input to the
+            # remote cat, so only move the upload into place from here.
+            mv_result = runner.run(
+                self._ssh_args + [self.remote_host, 'mv {} {}'.format(
+                    pipes.quote( self.remote_path + '.part' ),
+                    pipes.quote( self.remote_path )
+                )]
+            )
+            ssh_err = mv_result.stderr
+            if mv_result.success:
+                return
+
+        raise IOError( 'Upload to {}:{} failed: {}'.format(
+            self.remote_host, self.remote_path, ssh_err.strip() or self._error
+        ) )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        if None != exc_type:
+            self.abort()
+        else:
+            self.close()
+
+class SSHDownload( object ):
+
+    ''' A readable file-like object streaming remote_path from remote_host
+    over SSH. '''
+
+    def __init__( self, remote_host, remote_path, pooled=True ):
+        self.remote_host = remote_host
+        self.remote_path = remote_path
+        self.closed = False
+
+        ssh_args = ['ssh']
+        if pooled:
+            ssh_args += _ssh_control_args()
+        ssh_args += [remote_host, 'cat {}'.format( pipes.quote( remote_path ) )]
+
+        with open( os.devnull ) as devnull:
+            self._proc, self._result = runner.spawn(
+                ssh_args, stdin=devnull, stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+
+    def read( self, size=-1 ):
+        return self._proc.stdout.read( size )
+
+    def close( self ):
+        if self.closed:
+            return
+        self.closed = True
+
+        # Drain anything left so ssh can exit.
+        while self._proc.stdout.read( 64 * 1024 ):
+            pass
+        ssh_err = self._proc.stderr.read()
+        if not runner.finish( self._proc, self._result, ssh_err ).success:
+            raise IOError( 'Download from {}:{} failed: {}'.format(
+                self.remote_host, self.remote_path, ssh_err.strip()
+            ) )
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, exc_type, exc_value, traceback ):
+        if None != exc_type:
+            try:
+                self._proc.kill()
+            except OSError:
+                pass
+            runner.finish( self._proc, self._result )
+            self.closed = True
+        else:
+            self.close()
+
+def ssh_upload( remote_host, remote_path, pooled=True ):
+
+    ''' Return an SSHUpload writing to remote_path on remote_host. For
+    example, to ship an archive off-box without a local copy:
+
+    with net.ssh_upload( host, path ) as remote_file:
+        archive.create( remote_file, key, item_list=items ) '''
+
+    return SSHUpload( remote_host, remote_path, pooled=pooled )
+
+def ssh_download( remote_host, remote_path, pooled=True ):
+
+    ''' Return an SSHDownload reading remote_path from remote_host. '''
+
+    return SSHDownload( remote_host, remote_path, pooled=pooled )
+
+def main( argv=None ):
+
+    ''' Command line interface to ssh_command_many(). '''
+
+    parser = argparse.ArgumentParser(
+        description='Run a command on many hosts over SSH.'
+    )
+    parser.add_argument(
+        '-j', '--jobs', type=int, default=SSH_JOBS_MAX,
+        help='Number of hosts to run on at once.'
+    )
+    parser.add_argument(
+        '-t', '--timeout', type=float, default=None,
+        help='Seconds to allow each host.'
+    )
+    parser.add_argument(
+        '-H', '--host', action='append', dest='hosts', default=[],
+        help='Host to run on. May be given more than once.'
+    )
+    parser.add_argument(
+        '-f', '--hosts-file', default=None,
+        help='File listing hosts to run on, one per line.'
+    )
+    parser.add_argument( 'command', nargs='+', help='Command to run.' )
+    args = parser.parse_args( argv )
+
+    hosts = list( args.hosts )
+    if args.hosts_file:
+        with open( args.hosts_file ) as hosts_file:
+            hosts += [h.strip() for h in hosts_file
+                if h.strip() and not h.startswith( '#' )]
+    if not hosts:
+        parser.error( 'No hosts given.' )
+
+    results = ssh_command_many(
+        hosts, ' '.join( args.command ), max_jobs=args.jobs,
+        timeout=args.timeout, output=sys.stdout
+    )
+
+    # Summarize, slowest first.
+    status = 0
+    for remote_host, result in sorted(
+        results.items(), key=lambda r: r[1]['elapsed'], reverse=True
+    ):
+        if result['timed_out']:
+            state = 'timed out'
+        else:
+            state = 'exit {}'.format( result['returncode'] )
+        if 0 != result['returncode']:
+            status = 1
+        sys.stderr.write( '{}: {} in {:.2f}s\n'.format(
+            remote_host, state, result['elapsed']
+        ) )
 
-    subprocess.call( [ 'ssh', remote_host, command_exec ] )
+    return status
 
+if __name__ == '__main__':
+    sys.exit( main() )
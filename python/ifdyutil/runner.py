@@ -0,0 +1,362 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import subprocess
+import threading
+import logging
+import socket
+import atexit
+import time
+import os
+import tempfile
+
+# Seconds a command may run before it is killed, unless the caller says
+# otherwise.
+COMMAND_TIMEOUT = 300
+
+# Seconds to keep reading output after killing a command that timed out, in
+# case something it started is still holding the pipes.
+COMMAND_KILL_GRACE = 1
+
+# Upper bounds (seconds) of the latency histogram buckets.
+DURATION_BUCKETS = [
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300
+]
+
+PROMETHEUS_PREFIX = 'ifdyutil_command'
+STATSD_PREFIX = 'ifdyutil.command'
+
+_DEFAULT = object()
+
+_sinks = []
+_sinks_lock = threading.Lock()
+
+class CommandResult( object ):
+
+    ''' The outcome of one external command. returncode is None if the command
+    could not be started at all, and negative if it was killed. '''
+
+    def __init__( self, argv ):
+        self.argv = argv
+        self.tool = os.path.basename( argv[0] )
+        self.returncode = None
+        self.stdout = ''
+        self.stderr = ''
+        self.elapsed = 0.0
+        self.timed_out = False
+        self.started = time.time()
+
+    @property
+    def success( self ):
+        return 0 == self.returncode
+
+class CommandStats( object ):
+
+    ''' Per-tool call, failure and timeout counters and latency histograms. '''
+
+    def __init__( self ):
+        self._lock = threading.Lock()
+        self.tools = {}
+
+    def record( self, result ):
+        with self._lock:
+            tool = self.tools.setdefault( result.tool, {
+                'calls': 0,
+                'failures': 0,
+                'timeouts': 0,
+                'seconds': 0.0,
+                'buckets': [0] * len( DURATION_BUCKETS ),
+            } )
+            tool['calls'] += 1
+            if not result.success:
+                tool['failures'] += 1
+            if result.timed_out:
+                tool['timeouts'] += 1
+            tool['seconds'] += result.elapsed
+            for i, bound in enumerate( DURATION_BUCKETS ):
+                if result.elapsed <= bound:
+                    tool['buckets'][i] += 1
+
+    def snapshot( self ):
+
+        ''' Return a copy of the stats that is safe to read. '''
+
+        with self._lock:
+            return dict( (name, dict( tool, buckets=list( tool['buckets'] ) ))
+                for name, tool in self.tools.items() )
+
+# Always kept, so scripts can see where their time went without a sink.
+STATS = CommandStats()
+
+class PrometheusTextfileSink( object ):
+
+    ''' Keep CommandStats and write them in Prometheus text format to path,
+    for node_exporter's textfile collector. The file is rewritten at most
+    every interval seconds and once more at exit if still registered. '''
+
+    def __init__( self, path, interval=10 ):
+        self.path = path
+        self.interval = interval
+        self.stats = CommandStats()
+        self._written = 0
+        self._flush_lock = threading.Lock()
+        atexit.register( self._exit_flush )
+
+    def _exit_flush( self ):
+        with _sinks_lock:
+            registered = self in _sinks
+        if registered:
+            self.flush()
+
+    def record( self, result ):
+        self.stats.record( result )
+        if time.time() - self._written >= self.interval:
+            self.flush()
+
+    def render( self ):
+        lines = []
+        tools = sorted( self.stats.snapshot().items() )
+        for metric, key, metric_type in (
+            ('calls_total', 'calls', 'counter'),
+            ('failures_total', 'failures', 'counter'),
+            ('timeouts_total', 'timeouts', 'counter'),
+        ):
+            lines.append( '# TYPE {}_{} {}'.format(
+                PROMETHEUS_PREFIX, metric, metric_type
+            ) )
+            for name, tool in tools:
+                lines.append( '{}_{}{{tool="{}"}} {}'.format(
+                    PROMETHEUS_PREFIX, metric, name, tool[key]
+                ) )
+
+        metric = '{}_duration_seconds'.format( PROMETHEUS_PREFIX )
+        lines.append( '# TYPE {} histogram'.format( metric ) )
+        for name, tool in tools:
+            for bound, count in zip( DURATION_BUCKETS, tool['buckets'] ):
+                lines.append( '{}_bucket{{tool="{}",le="{}"}} {}'.format(
+                    metric, name, bound, count
+                ) )
+            lines.append( '{}_bucket{{tool="{}",le="+Inf"}} {}'.format(
+                metric, name, tool['calls']
+            ) )
+            lines.append( '{}_sum{{tool="{}"}} {}'.format(
+                metric, name, tool['seconds']
+            ) )
+            lines.append( '{}_count{{tool="{}"}} {}'.format(
+                metric, name, tool['calls']
+            ) )
+
+        return '\n'.join( lines ) + '\n'
+
+    def flush( self ):
+        with self._flush_lock:
+            self._written = time.time()
+
+            # Replace the file in one go so the collector never sees half of
+            # it.
+            temp_fd, temp_path = tempfile.mkstemp(
+                prefix='.{}.'.format( os.path.basename( self.path ) ),
+                dir=os.path.dirname( os.path.abspath( self.path ) )
+            )
+            try:
+                with os.fdopen( temp_fd, 'w' ) as prom_file:
+                    prom_file.write( self.render() )
+                os.chmod( temp_path, 0644 )
+                os.rename( temp_path, self.path )
+            except:
+                os.unlink( temp_path )
+                raise
+
+class StatsdSink( object ):
+
+    ''' Send a timer and counters for each command to a statsd daemon over UDP,
+    or over a UNIX datagram socket if address is a path. '''
+
+    def __init__( self, address=('127.0.0.1', 8125), prefix=STATSD_PREFIX ):
+        self.address = address
+        self.prefix = prefix
+        if isinstance( address, basestring ):
+            self._socket = socket.socket( socket.AF_UNIX, socket.SOCK_DGRAM )
+        else:
+            self._socket = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+
+    def record( self, result ):
+        stat = '{}.{}'.format( self.prefix, result.tool )
+        lines = [
+            '{}.duration:{:.3f}|ms'.format( stat, result.elapsed * 1000 ),
+            '{}.calls:1|c'.format( stat ),
+        ]
+        if not result.success:
+            lines.append( '{}.failures:1|c'.format( stat ) )
+        if result.timed_out:
+            lines.append( '{}.timeouts:1|c'.format( stat ) )
+        try:
+            self._socket.sendto( '\n'.join( lines ), self.address )
+        except socket.error:
+            # Metrics are best-effort.
+            pass
+
+def add_sink( sink ):
+
+    ''' Pass every command result to sink.record( result ) from now on. '''
+
+    with _sinks_lock:
+        if not sink in _sinks:
+            _sinks.append( sink )
+
+def remove_sink( sink ):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove( sink )
+
+def record( result ):
+
+    ''' Log and count a finished command. run() does this itself, but callers
+    managing a process of their own (e.g. a stream) should call it when done. '''
+
+    logger = logging.getLogger( 'ifdyutil.command' )
+
+    if result.success:
+        logger.debug( '{} finished in {:.3f}s.'.format(
+            ' '.join( result.argv ), result.elapsed
+        ) )
+    else:
+        logger.debug( '{} failed ({}{}) in {:.3f}s: {}'.format(
+            ' '.join( result.argv ), result.returncode,
+            ', timed out' if result.timed_out else '', result.elapsed,
+            result.stderr.strip()
+        ) )
+
+    STATS.record( result )
+    with _sinks_lock:
+        sinks = list( _sinks )
+    for sink in sinks:
+        try:
+            sink.record( result )
+        except Exception as exc:
+            # Metrics must never fail the command they describe.
+            logger.warning( 'Unable to record {} with {}: {}'.format(
+                result.tool, sink.__class__.__name__, exc
+            ) )
+
+def _read( stream, lines, line_cb ):
+    for line in iter( stream.readline, '' ):
+        lines.append( line )
+        if None != line_cb:
+            line_cb( line )
+    stream.close()
+
+def run(
+    argv, timeout=_DEFAULT, stdin=None, capture=True, stdout_cb=None,
+    stderr_cb=None
+):
+
+    ''' Run argv and return a CommandResult once it finishes, killing it after
+    timeout seconds (COMMAND_TIMEOUT by default, or never if None).
+
+    If capture is True, stdout and stderr are collected, and each line is
+    passed to stdout_cb/stderr_cb as it arrives. Otherwise they go wherever
+    ours do. Raises OSError if the command can't be started. '''
+
+    if timeout is _DEFAULT:
+        timeout = COMMAND_TIMEOUT
+
+    popen_args = {'stdin': stdin}
+    if capture:
+        popen_args['stdout'] = subprocess.PIPE
+        popen_args['stderr'] = subprocess.PIPE
+
+    proc, result = spawn( argv, **popen_args )
+
+    def expire():
+        result.timed_out = True
+        try:
+            proc.kill()
+        except OSError:
+            pass
+
+    timer = None
+    if None != timeout:
+        timer = threading.Timer( timeout, expire )
+        timer.daemon = True
+        timer.start()
+
+    readers = []
+    out_lines = []
+    err_lines = []
+    if capture:
+        readers = [
+            threading.Thread(
+                target=_read, args=(proc.stdout, out_lines, stdout_cb)
+            ),
+            threading.Thread(
+                target=_read, args=(proc.stderr, err_lines, stderr_cb)
+            ),
+        ]
+        for reader in readers:
+            reader.daemon = True
+            reader.start()
+
+    result.returncode = proc.wait()
+    if None != timer:
+        # Join so no timer thread is left running into interpreter shutdown.
+        timer.cancel()
+        timer.join()
+
+    grace_end = time.time() + COMMAND_KILL_GRACE
+    for reader in readers:
+        if result.timed_out:
+            reader.join( max( 0, grace_end - time.time() ) )
+        else:
+            reader.join()
+
+    result.stdout = ''.join( list( out_lines ) )
+    result.stderr = ''.join( list( err_lines ) )
+    result.elapsed = time.time() - result.started
+
+    record( result )
+
+    return result
+
+def spawn( argv, **popen_args ):
+
+    ''' Start argv for a caller that needs to drive it directly, e.g. to
+    stream through its pipes. Return the Popen object and a CommandResult to
+    hand to finish() afterwards. '''
+
+    result = CommandResult( argv )
+    try:
+        proc = subprocess.Popen( argv, **popen_args )
+    except OSError as exc:
+        result.stderr = str( exc )
+        result.elapsed = time.time() - result.started
+        record( result )
+        raise
+
+    return proc, result
+
+def finish( proc, result, stderr='' ):
+
+    ''' Wait for a process from spawn() and record its result. '''
+
+    result.returncode = proc.wait()
+    result.stderr = stderr
+    result.elapsed = time.time() - result.started
+    record( result )
+
+    return result
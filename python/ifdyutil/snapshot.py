@@ -17,20 +17,202 @@ You should have received a copy of the GNU Lesser General Public License along
 with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
-import subprocess
+import runner
+import file
 import re
+import json
+import time
+import calendar
+import logging
+import threading
+from datetime import date
 
-def snapshot_zfs( lvtarget, vgtarget ):
-    print "ZFS snapshot functionality not yet available."
-    return False
+LVS_FIELDS = [
+    'lv_name', 'vg_name', 'lv_attr', 'origin', 'lv_size', 'lv_time',
+    'data_percent'
+]
+LVS_SEPARATOR = '|'
+
+ZFS_LIST_FIELDS = ['name', 'creation', 'used', 'referenced']
+
+# Timeout for commands that change LVM or ZFS state. None means they are never
+# killed, as interrupting lvcreate, lvremove or zfs destroy partway through can
+# leave volume metadata inconsistent.
+STORAGE_COMMAND_TIMEOUT = None
+
+# Default limits on concurrent lvcreate runs for schedule_snapshots_lvm().
+SNAPSHOT_JOBS_MAX = 4
+SNAPSHOT_JOBS_PER_VG = 1
+
+# Whether lvs on this system understands --reportformat json. Set to False
+# the first time it turns out not to.
+_lvs_json = True
+
+class LVMInventory( object ):
+
+    ''' An index of the logical volumes on the system, built from a single lvs
+    call. Each volume is a dict with name, vg, attr, origin, size (bytes),
+    created (epoch seconds) and percent keys. '''
+
+    def __init__( self, volumes ):
+        self.volumes = {}
+        self._snapshots = {}
+        for volume in volumes:
+            self.volumes[(volume['vg'], volume['name'])] = volume
+            if volume['origin']:
+                self._snapshots.setdefault(
+                    (volume['vg'], volume['origin']), []
+                ).append( volume )
+
+    def volume( self, lvtarget, vgtarget ):
+        return self.volumes.get( (vgtarget, lvtarget) )
+
+    def snapshots( self, lvtarget, vgtarget ):
+
+        ''' Return the snapshots of the given volume, oldest first. '''
+
+        return sorted(
+            self._snapshots.get( (vgtarget, lvtarget), [] ),
+            key=lambda s: s['created']
+        )
+
+    def age( self, volume, now=None ):
+
+        ''' Return the age of the given volume in seconds. '''
+
+        if None == now:
+            now = time.time()
+        return now - volume['created']
+
+def snapshot_zfs( datasets, ssname=None, recursive=False ):
+
+    ''' Snapshot the given dataset or list of datasets. All snapshots are
+    taken by one zfs call, so they are atomic with respect to each other. '''
+
+    if isinstance( datasets, basestring ):
+        datasets = [datasets]
 
-def snapshot_lvm( lvtarget, vgtarget, size, ssname=None ):
     if None == ssname:
         # No snapshot name was defined, so use today's date.
         ssname = date.today().strftime( '%Y%m%d' )
 
-    # Code the snapshot according to today's date.
+    command = ['zfs', 'snapshot']
+    if recursive:
+        command.append( '-r' )
+    command += ['%s@%s' % (dataset, ssname) for dataset in datasets]
+
+    # Call the command.
+    try:
+        if not runner.run(
+            command, timeout=STORAGE_COMMAND_TIMEOUT
+        ).success:
+            return False
+    except OSError:
+        return False
+
+    # No news is good news.
+    return True
+
+def list_snapshots_zfs( datasets=None, recursive=False ):
+
+    ''' Return a dict of snapshot lists keyed by dataset, from one zfs list
+    call. Each snapshot is a dict with name, dataset, snapshot, created (epoch
+    seconds), used and referenced (bytes) keys, and lists are oldest first.
+    If datasets is given, only include those (and their descendants if
+    recursive is True). '''
+
+    if isinstance( datasets, basestring ):
+        datasets = [datasets]
+
     command = [
+        'zfs', 'list', '-H', '-p', '-t', 'snapshot',
+        '-o', ','.join( ZFS_LIST_FIELDS )
+    ]
+    if datasets:
+        command += ['-r'] + datasets
+
+    zfs_result = runner.run( command )
+    if zfs_result.returncode:
+        raise OSError( 'zfs list failed: {}'.format(
+            zfs_result.stderr.strip()
+        ) )
+
+    snapshots = {}
+    for line in zfs_result.stdout.splitlines():
+        if not line.strip():
+            continue
+        values = dict( zip( ZFS_LIST_FIELDS, line.split( '\t' ) ) )
+        dataset, snapshot = values['name'].split( '@', 1 )
+        if datasets and not recursive and not dataset in datasets:
+            continue
+        snapshots.setdefault( dataset, [] ).append( {
+            'name': values['name'],
+            'dataset': dataset,
+            'snapshot': snapshot,
+            'created': int( values['creation'] ),
+            'used': int( values['used'] ),
+            'referenced': int( values['referenced'] ),
+        } )
+
+    for dataset_snapshots in snapshots.values():
+        dataset_snapshots.sort( key=lambda s: s['created'] )
+
+    return snapshots
+
+def clean_snapshots_zfs( datasets, maxdays, recursive=False, snapshots=None ):
+
+    ''' Destroy all snapshots of the given datasets older than maxdays, with
+    one zfs destroy call per dataset. The result of list_snapshots_zfs() may be
+    passed in to avoid listing again. '''
+
+    logger = logging.getLogger( 'ifdyutil.snapshot.clean' )
+
+    if None == snapshots:
+        try:
+            snapshots = list_snapshots_zfs( datasets, recursive )
+        except OSError:
+            return False
+
+    if isinstance( datasets, basestring ):
+        datasets = [datasets]
+
+    now = time.time()
+    success = True
+    for dataset, dataset_snapshots in sorted( snapshots.items() ):
+        if not dataset in datasets and not (recursive and any(
+            dataset.startswith( d + '/' ) for d in datasets
+        )):
+            continue
+
+        expired = [
+            s['snapshot'] for s in dataset_snapshots
+            if now - s['created'] > maxdays * 86400
+        ]
+        if not expired:
+            continue
+
+        # zfs destroy takes a comma-separated list of one dataset's snapshots.
+        logger.info( 'Removing snapshots of {}: {}'.format(
+            dataset, ', '.join( expired )
+        ) )
+        try:
+            if not runner.run(
+                ['zfs', 'destroy', '%s@%s' % (dataset, ','.join( expired ))],
+                timeout=STORAGE_COMMAND_TIMEOUT
+            ).success:
+                success = False
+        except OSError:
+            success = False
+
+    return success
+
+def _snapshot_lvm_command( lvtarget, vgtarget, size, ssname=None ):
+    if None == ssname:
+        # No snapshot name was defined, so use today's date.
+        ssname = date.today().strftime( '%Y%m%d' )
+
+    # Code the snapshot according to today's date.
+    return [
         'lvcreate',
         '-L%s' % size,
         '-s',
@@ -39,26 +221,221 @@ def snapshot_lvm( lvtarget, vgtarget, size, ssname=None ):
         '%s/%s' % (vgtarget, lvtarget)
     ]
 
+def snapshot_lvm( lvtarget, vgtarget, size, ssname=None ):
+    command = _snapshot_lvm_command( lvtarget, vgtarget, size, ssname )
+
     # Call the command.
     try:
-        subprocess.check_call( command )
-    except:
+        if not runner.run(
+            command, timeout=STORAGE_COMMAND_TIMEOUT
+        ).success:
+            return False
+    except OSError:
         return False
 
     # No news is good news.
     return True
 
-def clean_snapshots_lvm( lvtarget, vgtarget, maxdays ):
-    # TODO: Iterate through existing snapshots and drop snapshots older than
-    #         maxdays.
-    print "Snapshot cleanup is not yet available."
-    return False
+def _schedule_snapshot_run( result, command ):
+    time_start = time.time()
+    try:
+        lvcreate_result = runner.run(
+            command, timeout=STORAGE_COMMAND_TIMEOUT
+        )
+        result['returncode'] = lvcreate_result.returncode
+        result['error'] = lvcreate_result.stderr.strip()
+    except OSError as exc:
+        result['error'] = str( exc )
+    result['success'] = 0 == result['returncode']
+    result['elapsed'] = time.time() - time_start
+
+def schedule_snapshots_lvm(
+    targets, ssname=None, max_jobs=SNAPSHOT_JOBS_MAX,
+    max_per_vg=SNAPSHOT_JOBS_PER_VG
+):
+
+    ''' Snapshot each (vgtarget, lvtarget, size) in targets, running lvcreate
+    concurrently but no more than max_jobs at once overall and max_per_vg at
+    once within any one volume group. Both limits must be at least 1.
+
+    Return a list of result dicts in the same order as targets, each with vg,
+    lv, size, name, success, returncode, error (stderr) and elapsed (seconds)
+    keys. '''
+
+    logger = logging.getLogger( 'ifdyutil.snapshot.schedule' )
+
+    if 1 > max_jobs or 1 > max_per_vg:
+        raise ValueError( 'max_jobs and max_per_vg must be at least 1.' )
+
+    results = []
+    pending = []
+    for vgtarget, lvtarget, size in targets:
+        command = _snapshot_lvm_command( lvtarget, vgtarget, size, ssname )
+        result = {
+            'vg': vgtarget,
+            'lv': lvtarget,
+            'size': size,
+            'name': command[4],
+            'success': False,
+            'returncode': None,
+            'error': None,
+            'elapsed': None,
+        }
+        results.append( result )
+        pending.append( (result, command) )
+
+    done = threading.Condition()
+    running = {'total': 0}
+    running_vg = {}
+
+    def run( result, command ):
+        try:
+            _schedule_snapshot_run( result, command )
+        finally:
+            with done:
+                running['total'] -= 1
+                running_vg[result['vg']] -= 1
+                done.notify()
+        if not result['success']:
+            logger.error( 'Snapshot {}/{} failed: {}'.format(
+                result['vg'], result['name'], result['error']
+            ) )
+
+    workers = []
+    with done:
+        while pending:
+            # Start whatever the limits allow, in the order given.
+            for job in list( pending ):
+                if running['total'] >= max_jobs:
+                    break
+                vgtarget = job[0]['vg']
+                if running_vg.get( vgtarget, 0 ) >= max_per_vg:
+                    continue
+                pending.remove( job )
+                running['total'] += 1
+                running_vg[vgtarget] = running_vg.get( vgtarget, 0 ) + 1
+                worker = threading.Thread( target=run, args=job )
+                worker.start()
+                workers.append( worker )
+            if pending:
+                done.wait()
+
+    for worker in workers:
+        worker.join()
+
+    return results
+
+def _parse_lv_time( lv_time ):
+
+    ''' Convert an lv_time string like "2015-03-01 02:00:00 -0500" to epoch
+    seconds. '''
+
+    if not lv_time:
+        return 0
+    stamp, offset = lv_time.rsplit( ' ', 1 )
+    created = calendar.timegm( time.strptime( stamp, '%Y-%m-%d %H:%M:%S' ) )
+    offset_secs = int( offset[1:3] ) * 3600 + int( offset[3:5] ) * 60
+    if '-' == offset[0]:
+        offset_secs = -offset_secs
+    return created - offset_secs
+
+def _lvs_volume( row ):
+    return {
+        'name': row['lv_name'],
+        'vg': row['vg_name'],
+        'attr': row['lv_attr'],
+        'origin': row['origin'],
+        'size': int( row['lv_size'] or 0 ),
+        'created': _parse_lv_time( row['lv_time'] ),
+        'percent': float( row['data_percent'] ) if row['data_percent'] \
+            else None,
+    }
+
+def inventory_lvm( vgtarget=None ):
+
+    ''' Return an LVMInventory of all logical volumes (optionally in vgtarget
+    only) from a single lvs call. '''
+
+    global _lvs_json
+
+    logger = logging.getLogger( 'ifdyutil.snapshot.inventory' )
+
+    command = [
+        'lvs', '--units', 'b', '--nosuffix', '-o', ','.join( LVS_FIELDS )
+    ]
+    if vgtarget:
+        command.append( vgtarget )
+
+    if _lvs_json:
+        lvs_result = runner.run(
+            command[:1] + ['--reportformat', 'json'] + command[1:]
+        )
+        if not lvs_result.returncode:
+            rows = []
+            for report in json.loads( lvs_result.stdout )['report']:
+                rows.extend( report['lv'] )
+            return LVMInventory( [_lvs_volume( r ) for r in rows] )
+
+        # Older LVM; fall back to separated output from now on.
+        logger.debug( 'lvs JSON report failed: {}'.format(
+            lvs_result.stderr.strip()
+        ) )
+        _lvs_json = False
+
+    lvs_result = runner.run(
+        command[:1] + ['--noheadings', '--separator', LVS_SEPARATOR] + \
+            command[1:]
+    )
+    if lvs_result.returncode:
+        raise OSError( 'lvs failed: {}'.format( lvs_result.stderr.strip() ) )
+
+    volumes = []
+    for line in lvs_result.stdout.splitlines():
+        if not line.strip():
+            continue
+        values = [v.strip() for v in line.split( LVS_SEPARATOR )]
+        volumes.append( _lvs_volume( dict( zip( LVS_FIELDS, values ) ) ) )
+    return LVMInventory( volumes )
+
+def clean_snapshots_lvm( lvtarget, vgtarget, maxdays, inventory=None ):
+
+    ''' Remove all snapshots of vgtarget/lvtarget older than maxdays with a
+    single lvremove call. An existing LVMInventory may be passed in to avoid
+    another lvs call. '''
+
+    logger = logging.getLogger( 'ifdyutil.snapshot.clean' )
+
+    if None == inventory:
+        try:
+            inventory = inventory_lvm( vgtarget )
+        except (OSError, ValueError):
+            return False
+
+    now = time.time()
+    expired = [
+        '%s/%s' % (vgtarget, s['name'])
+        for s in inventory.snapshots( lvtarget, vgtarget )
+        if inventory.age( s, now ) > maxdays * 86400
+    ]
+    if not expired:
+        return True
+
+    logger.info( 'Removing snapshots: {}'.format( ', '.join( expired ) ) )
+    try:
+        if not runner.run(
+            ['lvremove', '-f'] + expired, timeout=STORAGE_COMMAND_TIMEOUT
+        ).success:
+            return False
+    except OSError:
+        return False
+
+    return True
 
 def list_mounts_lvm():
     pattern_mapper = re.compile( r'^/dev/mapper/(\S*)\s*(\S*)' )
     lvm_mounts = [] # A list of tuples describing mounted LVM volumes.
     try:
-        with open( '/proc/mounts', 'r' ) as file_mounts:
+        with open( file.PROC_MOUNTS_PATH, 'r' ) as file_mounts:
             for line in file_mounts:
                 line_match = pattern_mapper.match( line )
                 if None != line_match:
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import StringIO
+import zipfile
+import re
+import struct
+import logging
+import hashlib
+import types
+import sys
+import os
+import tempfile
+import shutil
+from .. import archive
+
+class GrepTests( unittest.TestCase ):
+    def setUp( self ):
+        arcio = StringIO.StringIO()
+        with zipfile.ZipFile( arcio, 'w', zipfile.ZIP_DEFLATED ) as arcz:
+            for i in range( 20 ):
+                lines = ['line {} of log{}'.format( n, i ) for n in range( 500 )]
+                if 7 == i:
+                    lines[100] = 'kernel: Out of memory: Kill process 1234'
+                arcz.writestr( '/var/log/log{}.log'.format( i ), '\n'.join( lines ) )
+            arcz.writestr( '/var/log/auth.txt', 'sshd: Failed password\nok\n' )
+            arcz.writestr( '/index/MAIN_1.toc', 'Out of memory' )
+        self.archive = zipfile.ZipFile( arcio )
+
+    def test_grep( self ):
+        for threads in [1, 4]:
+            results = archive.grep(
+                self.archive, r'Out of memory: Kill process \d+', context=2,
+                threads=threads
+            )
+            assert 1 == len( results )
+            assert '/var/log/log7.log' == results[0]['filename']
+            assert 101 == results[0]['line']
+            assert ['line 98 of log7', 'line 99 of log7'] == \
+                results[0]['before']
+            assert ['line 101 of log7', 'line 102 of log7'] == \
+                results[0]['after']
+
+    def test_members( self ):
+        results = archive.grep( self.archive, 'Failed', members=['*.log'] )
+        assert [] == results
+        results = archive.grep( self.archive, 'Failed', members=['*.txt'] )
+        assert 1 == len( results )
+        assert '/var/log/auth.txt' == results[0]['filename']
+
+    def test_max_matches( self ):
+        results = archive.grep( self.archive, 'line 4', max_matches=5 )
+        assert 5 == len( results )
+        results = archive.grep(
+            self.archive, 'LINE 499', flags=re.IGNORECASE, threads=3
+        )
+        assert 20 == len( results )
+        # Results come back in archive order whatever the thread timing.
+        assert ['/var/log/log{}.log'.format( i ) for i in range( 20 )] == \
+            [r['filename'] for r in results]
+
+    def test_max_matches_order( self ):
+        for threads in [1, 4]:
+            results = archive.grep(
+                self.archive, 'line 49', max_matches=25, threads=threads
+            )
+            # Each log has 11 lines matching; the first 25 span three logs.
+            assert 25 == len( results )
+            assert ['/var/log/log0.log'] * 11 + ['/var/log/log1.log'] * 11 + \
+                ['/var/log/log2.log'] * 3 == [r['filename'] for r in results]
+
+    def test_max_matches_stops( self ):
+        class CountingRegex( object ):
+            def __init__( self ):
+                self.calls = 0
+
+            def search( self, line ):
+                self.calls += 1
+                return True
+
+        regex = CountingRegex()
+        results = archive.grep( self.archive, regex, max_matches=3, context=2 )
+        assert [1, 2, 3] == [r['line'] for r in results]
+        assert 2 == len( results[-1]['after'] )
+        assert 3 == regex.calls
+
+class PlainDecryptor( object ):
+    def decrypt( self, data ):
+        assert 0 == len( data ) % 16
+        return data
+
+class ShortReads( StringIO.StringIO ):
+    def read( self, size=-1 ):
+        return StringIO.StringIO.read( self, min( size, 1000 ) )
+
+class VerifyTests( unittest.TestCase ):
+    def setUp( self ):
+        arcio = StringIO.StringIO()
+        with zipfile.ZipFile( arcio, 'w', zipfile.ZIP_DEFLATED ) as arcz:
+            for i in range( 30 ):
+                arcz.writestr( '/var/log/log{}.log'.format( i ),
+                    '\n'.join( 'line {} {}'.format( n, i * n ) for n in range( 2000 ) ) )
+            arcz.writestr(
+                zipfile.ZipInfo( '/stored.txt' ), 'stored contents' * 100
+            )
+        self.data = arcio.getvalue()
+
+    def verify( self, data, threads=3 ):
+        report = {'members': 0, 'bytes': 0, 'errors': []}
+        chunks = (data[i:i + 1000] for i in range( 0, len( data ), 1000 ))
+        archive._verify_zip_stream(
+            archive._StreamReader( chunks ), report, threads
+        )
+        return report
+
+    def test_intact( self ):
+        report = self.verify( self.data )
+        assert [] == report['errors']
+        assert 31 == report['members']
+
+    def test_large_members( self ):
+        saved = archive.VERIFY_MEMBER_MAX
+        archive.VERIFY_MEMBER_MAX = 100
+        try:
+            report = self.verify( self.data )
+        finally:
+            archive.VERIFY_MEMBER_MAX = saved
+        assert [] == report['errors']
+        assert 31 == report['members']
+
+    def test_corrupt( self ):
+        info = zipfile.ZipFile( StringIO.StringIO( self.data ) ).getinfo(
+            '/stored.txt'
+        )
+        offset = info.header_offset + zipfile.sizeFileHeader + \
+            len( info.filename ) + 10
+        data = self.data[:offset] + 'X' + self.data[offset + 1:]
+        report = self.verify( data )
+        assert ['/stored.txt: bad CRC'] == report['errors']
+
+    def test_truncated( self ):
+        report = self.verify( self.data[:len( self.data ) // 2] )
+        assert 1 == len( report['errors'] )
+        assert 'truncated' in report['errors'][0]
+
+    def test_decrypt_chunks( self ):
+        padded = self.data + ' ' * (-len( self.data ) % 16)
+        counts = {'payload': 0}
+        plain = ''.join( archive._decrypt_chunks(
+            ShortReads( padded ), PlainDecryptor(), len( self.data ), counts
+        ) )
+        assert self.data == plain
+        assert len( padded ) == counts['payload']
+
+class NoSeek( object ):
+    def __init__( self, data ):
+        self._stream = StringIO.StringIO( data )
+
+    def read( self, size=-1 ):
+        return self._stream.read( size )
+
+class HeaderTests( unittest.TestCase ):
+    def test_versioned( self ):
+        header = 'RND1' + 's' * 160 + struct.pack( '<Q', 1234 ) + 'i' * 16
+        version, salt, size, iv = archive._read_header(
+            NoSeek( header ), logging.getLogger( 'test' )
+        )
+        assert ('RND1', 's' * 160, 1234, 'i' * 16) == (version, salt, size, iv)
+
+    def test_legacy_stream( self ):
+        # Unversioned archives start straight with the size.
+        header = struct.pack( '<Q', 5678 ) + 'i' * 16
+        version, salt, size, iv = archive._read_header(
+            NoSeek( header ), logging.getLogger( 'test' )
+        )
+        assert (None, None, 5678, 'i' * 16) == (version, salt, size, iv)
+
+    def test_truncated( self ):
+        self.assertRaises(
+            IOError, archive._read_header, NoSeek( 'RND1' ),
+            logging.getLogger( 'test' )
+        )
+
+class FakeCipher( object ):
+
+    ''' XORs with the key; enough to tell right keys from wrong ones. '''
+
+    def __init__( self, key ):
+        self.key = [ord( c ) for c in key[:16]]
+
+    def _xor( self, data ):
+        assert 0 == len( data ) % 16
+        return ''.join(
+            chr( ord( c ) ^ self.key[i % 16] ) for i, c in enumerate( data )
+        )
+
+    encrypt = decrypt = _xor
+
+class FakePBKDF2( object ):
+    def __init__( self, key, salt ):
+        self.digest = hashlib.sha256( key + salt ).digest()
+
+    def read( self, size ):
+        return self.digest[:size]
+
+class VerifyArchiveTests( unittest.TestCase ):
+
+    # Stand-ins for pbkdf2 and PyCrypto, which verify() imports.
+    MODULES = ['pbkdf2', 'Crypto', 'Crypto.Cipher', 'Crypto.Cipher.AES']
+
+    def setUp( self ):
+        self.saved = dict( (n, sys.modules.get( n )) for n in self.MODULES )
+        pbkdf2 = types.ModuleType( 'pbkdf2' )
+        pbkdf2.PBKDF2 = FakePBKDF2
+        aes = types.ModuleType( 'Crypto.Cipher.AES' )
+        aes.MODE_CBC = 2
+        aes.new = lambda key, mode, iv: FakeCipher( key )
+        cipher = types.ModuleType( 'Crypto.Cipher' )
+        cipher.AES = aes
+        crypto = types.ModuleType( 'Crypto' )
+        crypto.Cipher = cipher
+        sys.modules.update( {
+            'pbkdf2': pbkdf2, 'Crypto': crypto, 'Crypto.Cipher': cipher,
+            'Crypto.Cipher.AES': aes,
+        } )
+
+        self.root = tempfile.mkdtemp()
+        arcio = StringIO.StringIO()
+        with zipfile.ZipFile( arcio, 'w', zipfile.ZIP_DEFLATED ) as arcz:
+            for i in range( 10 ):
+                arcz.writestr( '/var/log/log{}.log'.format( i ),
+                    '\n'.join( 'line {} {}'.format( n, i ) for n in range( 500 ) ) )
+        self.zip_data = arcio.getvalue()
+        self.archive_path = self.write( 'good.arc', self.zip_data )
+
+    def tearDown( self ):
+        for name, module in self.saved.items():
+            if None == module:
+                sys.modules.pop( name, None )
+            else:
+                sys.modules[name] = module
+        shutil.rmtree( self.root )
+
+    def write( self, name, zip_data, key='secret', trailing='' ):
+
+        ''' Write zip_data as an archive the way create() does. '''
+
+        salt = 's' * 160
+        padded = zip_data + ' ' * (-len( zip_data ) % 16)
+        cipher = FakeCipher( FakePBKDF2( key, salt ).read( 32 ) )
+        archive_path = os.path.join( self.root, name )
+        with open( archive_path, 'wb' ) as archive_file:
+            archive_file.write( archive.VERSIONS[-1] + salt )
+            archive_file.write( struct.pack( '<Q', len( zip_data ) ) )
+            archive_file.write( 'i' * 16 )
+            archive_file.write( cipher.encrypt( padded ) + trailing )
+        return archive_path
+
+    def test_intact( self ):
+        report = archive.verify( self.archive_path, 'secret' )
+        assert [] == report['errors']
+        assert 10 == report['members']
+        assert len( self.zip_data ) == report['declared_size']
+        assert len( self.zip_data ) + (-len( self.zip_data ) % 16) == \
+            report['payload']
+
+    def test_wrong_key( self ):
+        report = archive.verify( self.archive_path, 'wrong' )
+        assert ['Payload is not a ZIP file; wrong key?'] == report['errors']
+
+    def test_truncated( self ):
+        with open( self.archive_path, 'rb' ) as archive_file:
+            data = archive_file.read()
+        cut = len( data ) - 512
+        with open( self.archive_path, 'wb' ) as archive_file:
+            archive_file.write( data[:cut] )
+        payload = cut - (4 + 160 + 8 + 16)
+
+        report = archive.verify( self.archive_path, 'secret' )
+        assert payload == report['payload']
+        assert 'Payload is {} bytes, header declares {}'.format(
+            payload, len( self.zip_data )
+        ) in report['errors']
+        assert 'Encrypted payload is {} bytes, expected {}'.format(
+            payload, len( self.zip_data ) + (-len( self.zip_data ) % 16)
+        ) in report['errors']
+
+    def test_trailing( self ):
+        archive_path = self.write( 'trailing.arc', self.zip_data, trailing='x' * 32 )
+        report = archive.verify( archive_path, 'secret' )
+        padded = len( self.zip_data ) + (-len( self.zip_data ) % 16)
+        assert ['Encrypted payload is {} bytes, expected {}'.format(
+            padded + 32, padded
+        )] == report['errors']
+
+    def test_main( self ):
+        key_path = os.path.join( self.root, 'key' )
+        with open( key_path, 'w' ) as key_file:
+            key_file.write( 'secret\n' )
+        bad_path = self.write( 'bad.arc', self.zip_data, key='other' )
+
+        saved_stderr = sys.stderr
+        sys.stderr = StringIO.StringIO()
+        try:
+            assert 0 == archive.main( ['-k', key_path, self.archive_path] )
+            assert 1 == archive.main(
+                ['-k', key_path, self.archive_path, bad_path]
+            )
+            output = sys.stderr.getvalue()
+        finally:
+            sys.stderr = saved_stderr
+        assert '{}: OK, 10 members'.format( self.archive_path ) in output
+        assert '{}: FAILED (Payload is not a ZIP file; wrong key?)'.format(
+            bad_path
+        ) in output
+        assert 'Verified 2 archives' in output
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+''' Offline benchmarks for file, snapshot and config against a FakeSystem.
+Run with: python -m ifdyutil.tests.bench [-o history.jsonl] '''
+
+import os
+import sys
+import json
+import time
+import timeit
+import argparse
+import platform
+import subprocess
+from .. import file
+from .. import config
+from .. import snapshot
+from .fake_tools import FakeSystem
+
+BENCH_PIDS = 1000
+BENCH_LOCK_PROCS = 200
+BENCH_MOUNTS = 5000
+BENCH_CONFIG_VARS = 200
+
+def _best( func, number, repeat=3 ):
+
+    ''' Return the best per-call time of func in seconds. '''
+
+    return min( timeit.repeat( func, number=number, repeat=repeat ) ) / number
+
+class Bench( object ):
+
+    def __init__( self, system, scale=1.0 ):
+        self.system = system
+        self.scale = scale
+        self.results = {}
+        self._procs = []
+
+    def _n( self, count ):
+        return max( 1, int( count * self.scale ) )
+
+    def setup( self ):
+        self.system.fake_system_tools()
+
+        # Plenty of processes holding remount locks on other filesystems.
+        with open( os.devnull, 'w' ) as devnull:
+            for i in range( self._n( BENCH_LOCK_PROCS ) ):
+                self._procs.append( subprocess.Popen(
+                    ['sleep', '600'], stdout=devnull, stderr=devnull
+                ) )
+        for i, proc in enumerate( self._procs ):
+            self.system.add_fs_lock(
+                proc.pid, [('/srv/vol{}'.format( i ), 'rw'), ('/home', 'rw')]
+            )
+
+        self.system.set_pids( range( 1000, 1000 + self._n( BENCH_PIDS ) ) )
+
+        for i in range( self._n( BENCH_MOUNTS ) ):
+            self.system.add_mount(
+                '/dev/mapper/vg-lv{}'.format( i ), '/srv/vol{}'.format( i )
+            )
+        self.mount_path = os.path.join( self.system.root, 'secure' )
+        self.system.add_mount( '/dev/sda1', self.mount_path )
+
+        self.block_path = os.path.join( self.system.root, 'sdb1' )
+        self.key_path = os.path.join( self.system.root, 'key' )
+        self.crypt_path = os.path.join( self.system.root, 'crypt' )
+        for path in (self.block_path, self.key_path):
+            open( path, 'w' ).close()
+        os.mkdir( self.crypt_path )
+
+        self.system.write_config( dict(
+            ('QN_VAR_{}'.format( i ), 'value{}'.format( i ))
+            for i in range( BENCH_CONFIG_VARS )
+        ) )
+
+    def teardown( self ):
+        # May follow a setup() that failed partway, so only undo what it did.
+        for proc in self._procs:
+            proc.kill()
+            proc.wait()
+        self._procs = []
+
+    def bench_get_process_pid( self ):
+        return _best( lambda: file.get_process_pid( 'conky' ), 20 )
+
+    def bench_check_fs_lock( self ):
+        # Nobody holds this one, so every lock file has to be read.
+        return _best( lambda: file._check_fs_lock(
+            '/srv/unlocked', file.LOCK_TYPE_REMOUNT, perm='ro'
+        ), 5 )
+
+    def bench_mount_check( self ):
+        return _best( lambda: file._mount_check( self.mount_path ), 20 )
+
+    def bench_remount( self ):
+        return _best( lambda: file.remount(
+            self.mount_path, 'rw', register_cleanup=False
+        ), 5 )
+
+    def bench_mount_crypt( self ):
+        def cycle():
+            file.mount_crypt(
+                self.block_path, 'bench', self.crypt_path, self.key_path,
+                register_cleanup=False
+            )
+            file.umount_crypt( 'bench', self.crypt_path )
+        return _best( cycle, 2 )
+
+    def bench_lvs_inventory( self ):
+        return _best( snapshot.inventory_lvm, 20 )
+
+    def bench_config_load_cold( self ):
+        def cold():
+            config._cache['stamps'] = None
+            config.load()
+        return _best( cold, 200 )
+
+    def bench_config_load_warm( self ):
+        return _best( config.load, 2000 )
+
+    def bench_check_var_cold( self ):
+        def cold():
+            config._cache['stamps'] = None
+            config.check_var( 'QN_VAR_50' )
+        return _best( cold, 200 )
+
+    def bench_check_var_warm( self ):
+        return _best( lambda: config.check_var( 'QN_VAR_50' ), 2000 )
+
+    def run( self ):
+        for name in sorted( dir( self ) ):
+            if name.startswith( 'bench_' ):
+                self.results[name[6:]] = getattr( self, name )()
+        return self.results
+
+def _last_results( history_path ):
+
+    ''' Return the last recorded results in history_path, if any. '''
+
+    previous = None
+    if os.path.exists( history_path ):
+        with open( history_path ) as history_file:
+            for line in history_file:
+                if line.strip():
+                    previous = json.loads( line )['results']
+    return previous
+
+def main( argv=None ):
+    parser = argparse.ArgumentParser(
+        description='Benchmark ifdyutil against stand-in system tools.'
+    )
+    parser.add_argument(
+        '-o', '--output', default=None,
+        help='Append results to this JSON lines file and compare them with '
+            'the last run recorded there.'
+    )
+    parser.add_argument(
+        '-s', '--scale', type=float, default=1.0,
+        help='Multiply the number of fake processes, locks and mounts.'
+    )
+    args = parser.parse_args( argv )
+
+    system = FakeSystem()
+    system.start()
+    bench = Bench( system, scale=args.scale )
+    try:
+        bench.setup()
+        results = bench.run()
+    finally:
+        bench.teardown()
+        system.stop()
+
+    previous = None
+    if args.output:
+        previous = _last_results( args.output )
+
+    for name, seconds in sorted( results.items() ):
+        line = '{:<24} {:>12.1f} us'.format( name, seconds * 1000000 )
+        if previous and previous.get( name ):
+            line += '  ({:+.0%})'.format( seconds / previous[name] - 1 )
+        print( line )
+
+    if args.output:
+        with open( args.output, 'a' ) as history_file:
+            history_file.write( json.dumps( {
+                'time': int( time.time() ),
+                'host': platform.node(),
+                'python': platform.python_version(),
+                'scale': args.scale,
+                'results': results,
+            } ) + '\n' )
+
+if __name__ == '__main__':
+    main()
@@ -18,17 +18,101 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import unittest
+import tempfile
+import shutil
+import os
+import time
+import threading
 from .. import config
+from .fake_tools import FakeToolTests
 
-class ConfigTests( unittest.TestCase ):
-    def runTest( self ):
-        pass
+class ConfigTests( FakeToolTests ):
+    def setUp( self ):
+        super( ConfigTests, self ).setUp()
+        self.system.write_config( {'QN_VARS_DEFINED': 'true', 'QN_USER': 'a'} )
 
     def test_load( self ):
         cfg = config.load()
 
         assert 'true' == cfg['QN_VARS_DEFINED']
 
+        # The per-user config overrides the system one.
+        self.system.write_config( {'QN_USER': 'b'}, user=True )
+        assert 'b' == config.load()['QN_USER']
+
     def test_check( self ):
         config.check_var( 'QN_VARS_DEFINED' )
 
+    def test_missing( self ):
+        os.unlink( self.system.config_path )
+        self.assertRaises( IOError, config.load )
+
+
+class CachedConfigTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+        self.saved = (config.SYSTEM_CONFIG_PATH, os.environ.get( 'HOME' ))
+        config.SYSTEM_CONFIG_PATH = os.path.join( self.root, 'qnvars.sh' )
+        os.environ['HOME'] = os.path.join( self.root, 'home' )
+        os.mkdir( os.environ['HOME'] )
+        self.write( config.SYSTEM_CONFIG_PATH, 'A=1\n#B=2\nC=3\n' )
+
+    def tearDown( self ):
+        config.unwatch()
+        config.SYSTEM_CONFIG_PATH = self.saved[0]
+        os.environ['HOME'] = self.saved[1]
+        shutil.rmtree( self.root )
+
+    def write( self, path, contents ):
+        # Write via rename, like most editors do.
+        with open( path + '.new', 'w' ) as config_file:
+            config_file.write( contents )
+        os.rename( path + '.new', path )
+
+    def test_cache( self ):
+        cfg = config.load()
+        assert {'A': '1', 'C': '3'} == cfg
+        cfg['A'] = 'changed'
+        assert '1' == config.check_var( 'A' )
+        assert config._load_cached() is config._load_cached()
+
+        self.write( os.path.join( os.environ['HOME'], 'qnvars.sh' ), 'C=4\n' )
+        assert '4' == config.check_var( 'C' )
+
+    def test_watch( self ):
+        changes = []
+        changed = threading.Event()
+        def on_change( cfg ):
+            changes.append( cfg )
+            changed.set()
+
+        config.load()
+        config.subscribe( on_change )
+        try:
+            assert config.watch()
+            self.write( config.SYSTEM_CONFIG_PATH, 'A=5\n' )
+            assert changed.wait( 5 )
+            assert {'A': '5'} == changes[-1]
+        finally:
+            config.unsubscribe( on_change )
+
+    def test_watch_busy( self ):
+        changes = []
+        def on_change( cfg ):
+            changes.append( cfg )
+
+        config.subscribe( on_change )
+        try:
+            assert config.watch()
+
+            # A busy caller may see the change before the watcher does.
+            self.write( config.SYSTEM_CONFIG_PATH, 'A=6\n' )
+            assert '6' == config.check_var( 'A' )
+            config.reload()
+            assert [{'A': '6'}] == changes
+
+            # Nothing new, so nothing to report.
+            config.reload()
+            assert 1 == len( changes )
+        finally:
+            config.unsubscribe( on_change )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import StringIO
+from .. import console
+
+class FakeClock( object ):
+    def __init__( self ):
+        self.now = 1000.0
+
+    def __call__( self ):
+        return self.now
+
+class TTYStringIO( StringIO.StringIO ):
+    def isatty( self ):
+        return True
+
+class ProgressTests( unittest.TestCase ):
+    def test_summary_throttle( self ):
+        clock = FakeClock()
+        out = StringIO.StringIO()
+        progress = console.Progress(
+            'Storing', total_items=1000, stream=out, summary_interval=10,
+            clock=clock
+        )
+        for i in range( 1000 ):
+            clock.now += 0.03125
+            progress( 1, 1024, 'item{}'.format( i ) )
+        progress.finish()
+
+        lines = out.getvalue().splitlines()
+        # 31.25 seconds of updates at one summary per 10 seconds, plus finish.
+        assert 4 == len( lines )
+        assert lines[-1].startswith( 'Storing: 1000/1000 items, 1000.0 KiB' )
+        assert '32.0 items/s' in lines[-1]
+        assert 'ETA 0:00:00' in lines[-1]
+
+    def test_eta( self ):
+        clock = FakeClock()
+        progress = console.Progress(
+            'Copy', total_bytes=1000, stream=StringIO.StringIO(), clock=clock
+        )
+        clock.now += 10
+        progress.update( 0, 250 )
+        item_rate, byte_rate, eta = progress.rates()
+        assert 25 == byte_rate
+        assert 30 == eta
+        assert '0:00:30' == console.format_eta( eta )
+
+    def test_tty_redraw( self ):
+        clock = FakeClock()
+        out = TTYStringIO()
+        with console.Progress(
+            'Scan', stream=out, interval=0.25, clock=clock
+        ) as progress:
+            for i in range( 100 ):
+                clock.now += 0.015625
+                progress.update()
+
+        # One redraw per quarter second, then the final one.
+        assert 7 == out.getvalue().count( '\r' )
+        assert out.getvalue().endswith( '\n' )
+        assert 'Scan: 100 items' in out.getvalue()
+
+    def test_format_bytes( self ):
+        assert '512.0 B' == console.format_bytes( 512 )
+        assert '1.5 MiB' == console.format_bytes( 1536 * 1024 )
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import tempfile
+import shutil
+import os
+from .. import file
+from .. import config
+
+class FakeSystem( object ):
+
+    ''' Stand-in system tools, /proc/mounts, device mapper, lock
+    directories, config files and home directory under a temporary root, so
+    file, config, snapshot and net can be exercised without root, real devices
+    or a real network. '''
+
+    def __init__( self ):
+        self.root = tempfile.mkdtemp()
+        self.bin_dir = os.path.join( self.root, 'bin' )
+        self.log_path = os.path.join( self.root, 'calls.log' )
+        self.mounts_path = os.path.join( self.root, 'mounts' )
+        self.mapper_dir = os.path.join( self.root, 'mapper' )
+        self.pids_path = os.path.join( self.root, 'pids' )
+        self.lvs_path = os.path.join( self.root, 'lvs.json' )
+        self.remount_lock_dir = os.path.join( self.root, 'lock', 'qnrmount' )
+        self.mount_lock_dir = os.path.join( self.root, 'lock', 'qnmount' )
+        self.home_dir = os.path.join( self.root, 'home' )
+        self.config_path = os.path.join( self.root, 'etc', 'qnvars.sh' )
+        for dir_path in (self.bin_dir, self.mapper_dir, self.remount_lock_dir,
+            self.mount_lock_dir, self.home_dir,
+            os.path.dirname( self.config_path )):
+            os.makedirs( dir_path )
+        for path in (self.mounts_path, self.pids_path):
+            open( path, 'w' ).close()
+        with open( self.lvs_path, 'w' ) as lvs_file:
+            lvs_file.write( '{"report": [{"lv": []}]}' )
+        self._saved = None
+
+    def start( self ):
+        self._saved = (
+            os.environ['PATH'], file.PROC_MOUNTS_PATH, file.CRYPT_MAPPER_PATH,
+            file.FS_REMOUNT_LOCK_PATH, file.FS_MOUNT_LOCK_PATH,
+            file.FS_REMOUNT_SYSCALL, config.SYSTEM_CONFIG_PATH,
+            os.environ.get( 'HOME' )
+        )
+        os.environ['PATH'] = self.bin_dir + os.pathsep + os.environ['PATH']
+        file.PROC_MOUNTS_PATH = self.mounts_path
+        file.CRYPT_MAPPER_PATH = self.mapper_dir
+        file.FS_REMOUNT_LOCK_PATH = self.remount_lock_dir
+        file.FS_MOUNT_LOCK_PATH = self.mount_lock_dir
+        file.FS_REMOUNT_SYSCALL = False
+        config.SYSTEM_CONFIG_PATH = self.config_path
+        os.environ['HOME'] = self.home_dir
+        self._reset_config()
+
+    def stop( self ):
+        os.environ['PATH'], file.PROC_MOUNTS_PATH, file.CRYPT_MAPPER_PATH, \
+            file.FS_REMOUNT_LOCK_PATH, file.FS_MOUNT_LOCK_PATH, \
+            file.FS_REMOUNT_SYSCALL, config.SYSTEM_CONFIG_PATH, \
+            home = self._saved
+        if None == home:
+            os.environ.pop( 'HOME', None )
+        else:
+            os.environ['HOME'] = home
+        self._reset_config()
+        shutil.rmtree( self.root )
+
+    def _reset_config( self ):
+        with config._cache_lock:
+            config._cache['stamps'] = None
+            config._cache['cfg'] = None
+
+    def fake_tool( self, name, script ):
+
+        ''' Install a stand-in for tool name. Each call is logged along with its
+        arguments before the given shell script runs. '''
+
+        tool_path = os.path.join( self.bin_dir, name )
+        with open( tool_path, 'w' ) as tool_file:
+            tool_file.write( '#!/bin/sh\necho "{} $*" >> "{}"\n{}\n'.format(
+                name, self.log_path, script
+            ) )
+        os.chmod( tool_path, 0755 )
+
+    def fake_system_tools( self ):
+
+        ''' Install stand-ins for pgrep, mount, umount, cryptsetup, lvcreate and
+        lvs that act on the fake system. '''
+
+        self.fake_tool( 'pgrep', 'cat "{}"'.format( self.pids_path ) )
+        self.fake_tool( 'mount', '''case "$2" in
+    remount,*) ;;
+    *) echo "$1 $2 ext4 rw 0 0" >> "{}" ;;
+esac'''.format( self.mounts_path ) )
+        self.fake_tool( 'umount', '''grep -v " $1 " "{0}" > "{0}.new"
+mv "{0}.new" "{0}"'''.format( self.mounts_path ) )
+        self.fake_tool( 'cryptsetup', '''case "$1" in
+    luksOpen) eval name=\$$# ; touch "{0}/$name" ;;
+    luksClose) rm -f "{0}/$2" ;;
+esac'''.format( self.mapper_dir ) )
+        self.fake_tool( 'lvcreate', '' )
+        self.fake_tool( 'lvs', 'cat "{}"'.format( self.lvs_path ) )
+
+    def add_mount( self, device, mount_path, fs_type='ext4', options='rw' ):
+        with open( self.mounts_path, 'a' ) as mounts_file:
+            mounts_file.write( '{} {} {} {} 0 0\n'.format(
+                device, mount_path, fs_type, options
+            ) )
+
+    def set_pids( self, pids ):
+
+        ''' Set the PIDs the fake pgrep reports. '''
+
+        with open( self.pids_path, 'w' ) as pids_file:
+            for pid in pids:
+                pids_file.write( '{}\n'.format( pid ) )
+
+    def add_fs_lock( self, pid, entries, lock_dir=None ):
+
+        ''' Write a lock file for pid listing (mount path, perm) entries. '''
+
+        if None == lock_dir:
+            lock_dir = self.remount_lock_dir
+        with open( os.path.join( lock_dir, str( pid ) ), 'w' ) as lock_file:
+            lock_file.write( '\n'.join(
+                '{}:{}'.format( path, perm ) for path, perm in entries
+            ) )
+
+    def write_config( self, cfg, user=False ):
+
+        ''' Write cfg (a dict) as the system config, or the user's if user is
+        True. '''
+
+        if user:
+            config_path = os.path.join( self.home_dir, config.USER_CONFIG_NAME )
+        else:
+            config_path = self.config_path
+        with open( config_path, 'w' ) as config_file:
+            for name, value in sorted( cfg.items() ):
+                config_file.write( '{}={}\n'.format( name, value ) )
+
+    def calls( self ):
+        if not os.path.exists( self.log_path ):
+            return []
+        with open( self.log_path ) as log_file:
+            return [line.split() for line in log_file]
+
+    def clear_calls( self ):
+        if os.path.exists( self.log_path ):
+            os.unlink( self.log_path )
+
+class FakeToolTests( unittest.TestCase ):
+
+    ''' Base for tests that run against a FakeSystem. '''
+
+    def setUp( self ):
+        self.system = FakeSystem()
+        self.system.start()
+        self.bin_dir = self.system.bin_dir
+        self.log_path = self.system.log_path
+
+    def tearDown( self ):
+        self.system.stop()
+
+    def fake_tool( self, name, script ):
+        self.system.fake_tool( name, script )
+
+    def calls( self ):
+        return self.system.calls()
@@ -19,23 +19,347 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
 import mimetypes
+import tempfile
+import shutil
+import os
+import threading
+import time
 from .. import file
+from .fake_tools import FakeToolTests
 
-class FileTests( unittest.TestCase ):
-    def runTest( self ):
-        pass
+class FileTests( FakeToolTests ):
+    def setUp( self ):
+        super( FileTests, self ).setUp()
+        self.system.fake_system_tools()
 
     def test_listdir_mime( self ):
-        test_list = file.listdir_mime( '.', ['application/x-python-code'] )
-        assert [] != test_list
+        list_dir = os.path.join( self.system.root, 'listdir' )
+        os.mkdir( list_dir )
+        for name in ['a.pyc', 'b.pyc', 'c.py', 'd.txt']:
+            open( os.path.join( list_dir, name ), 'w' ).close()
+        test_list = file.listdir_mime( list_dir, ['application/x-python-code'] )
+        assert ['a.pyc', 'b.pyc'] == sorted( test_list )
         for entry in test_list:
             assert 'application/x-python-code' == mimetypes.guess_type( entry )[0]
 
+    def test_guess_mime( self ):
+        for name in ['a.py', 'b.PY', 'c.tar.gz', 'd.tgz', 'e.txt.bz2', 'f',
+            '.bashrc', 'g.html', 'h.unknownext']:
+            assert mimetypes.guess_type( name )[0] == file.guess_mime( name )
+
     def test_get_process_pid( self ):
-        # TODO: Arrange an actual test for this.
-        #print file.get_process_pid( 'conky' )
-        pass
+        assert [] == file.get_process_pid( 'conky' )
+        self.system.set_pids( [42] )
+        assert ['42'] == file.get_process_pid( 'conky' )
 
     def test_remount( self ):
-        print file.remount( '/foo/fii', '/var/lock' )
+        mount_path = os.path.join( self.system.root, 'data' )
+        self.system.add_mount( '/dev/sda2', mount_path, options='ro' )
+        self.assertRaises(
+            file.RemountException, file.remount, mount_path, '/var/lock'
+        )
+        file.remount( mount_path, 'rw', register_cleanup=False )
+        assert [['mount', '-o', 'remount,rw', mount_path]] == self.calls()
+
+class RemountRefTests( unittest.TestCase ):
+    def setUp( self ):
+        self.remounts = []
+        self.exit_hooks = []
+        self.saved = (
+            file._remount_fs, file._check_fs_lock, file._create_fs_lock,
+            file._remove_fs_lock, file.atexit.register
+        )
+        file._remount_fs = lambda path, perm: self.remounts.append( perm )
+        file._check_fs_lock = lambda path, lock_type, perm='': True
+        file._create_fs_lock = lambda path, lock_type, perm='': None
+        file._remove_fs_lock = lambda path, lock_type: None
+        file.atexit.register = \
+            lambda func, *args: self.exit_hooks.append( (func, args) )
+
+    def tearDown( self ):
+        file._remount_fs, file._check_fs_lock, file._create_fs_lock, \
+            file._remove_fs_lock, file.atexit.register = self.saved
+        file._remount_refs.clear()
+
+    def test_nested_remount( self ):
+        file.remount( '/foo/fii', 'rw' )
+        file.remount( '/foo/fii', 'rw' )
+        file.remount( '/foo/fii', 'rw' )
+        assert ['rw'] == self.remounts
+        assert 1 == len( self.exit_hooks )
+
+        file.release_remount( '/foo/fii', 'rw' )
+        file.release_remount( '/foo/fii', 'rw' )
+        assert ['rw'] == self.remounts
+        file.release_remount( '/foo/fii', 'rw' )
+        assert ['rw', 'ro'] == self.remounts
+
+        # The exit hook has nothing left to undo.
+        func, args = self.exit_hooks[0]
+        func( *args )
+        assert ['rw', 'ro'] == self.remounts
+
+    def test_remount_exit_hook( self ):
+        file.remount( '/foo/fii', 'rw' )
+        file.remount( '/foo/fii', 'rw' )
+        func, args = self.exit_hooks[0]
+        func( *args )
+        assert ['rw', 'ro'] == self.remounts
+
+class ScanMimeTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+        for dir_path in ['a', 'a/b', 'a/b/c', 'skip', 'd']:
+            os.mkdir( os.path.join( self.root, dir_path ) )
+        for file_path in ['top.txt', 'a/one.txt', 'a/b/two.txt', 'a/b/c/x.py',
+            'skip/three.txt', 'd/four.log', 'd/noext']:
+            with open( os.path.join( self.root, file_path ), 'w' ) as f:
+                f.write( 'test\n' )
+        with open( os.path.join( self.root, 'd/noext' ), 'w' ) as f:
+            f.write( '#!/bin/sh\n' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.root )
+
+    def _rel( self, paths ):
+        return sorted( os.path.relpath( p, self.root ) for p in paths )
+
+    def test_scan_recursive( self ):
+        found = self._rel( file.scan_mime(
+            self.root, ['text/plain'], exclude=['skip']
+        ) )
+        assert ['a/b/two.txt', 'a/one.txt', 'top.txt'] == found
+
+    def test_scan_threads( self ):
+        found = self._rel( file.scan_mime( self.root, threads=4 ) )
+        assert 7 == len( found )
+        assert found == self._rel( file.scan_mime( self.root ) )
+
+    def test_scan_filters( self ):
+        found = self._rel( file.scan_mime(
+            self.root, include=['*.txt', '*.log'], recursive=False
+        ) )
+        assert ['top.txt'] == found
+        found = self._rel( file.scan_mime( self.root, include=['*.log'] ) )
+        assert ['d/four.log'] == found
+
+    def test_scan_sniff( self ):
+        found = self._rel( file.scan_mime(
+            self.root, ['text/x-script'], sniff=True
+        ) )
+        assert ['d/noext'] == found
+
+    def test_scan_no_scandir( self ):
+        checked = []
+        saved = (file._scandir, file._is_real_dir)
+        file._scandir = None
+        file._is_real_dir = lambda path: checked.append( path ) or \
+            saved[1]( path )
+        try:
+            found = self._rel( file.scan_mime( self.root, ['text/plain'] ) )
+            assert ['a/b/two.txt', 'a/one.txt', 'skip/three.txt', 'top.txt'] \
+                == found
+            del checked[:]
+
+            # A flat listing only checks the entries that match.
+            assert ['top.txt'] == file.listdir_mime( self.root, ['text/plain'] )
+            assert [os.path.join( self.root, 'top.txt' )] == checked
+        finally:
+            file._scandir, file._is_real_dir = saved
+
+    def test_scan_early_stop( self ):
+        scanner = file.scan_mime( self.root, threads=2 )
+        next( scanner )
+        scanner.close()
+
+class FileLockTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+        self.lock_path = os.path.join( self.root, 'test.lock' )
+
+    def tearDown( self ):
+        shutil.rmtree( self.root )
+
+    def test_exclusive( self ):
+        with file.FileLock( self.lock_path ) as lock:
+            with open( self.lock_path ) as pid_file:
+                assert str( os.getpid() ) == pid_file.read()
+            assert file.check_lock( self.lock_path )
+            other = file.FileLock( self.lock_path )
+            assert not other.acquire( blocking=False )
+            assert not other.acquire( timeout=0.1 )
+        assert other.acquire( timeout=5 )
+        other.release()
+        assert not file.check_lock( self.lock_path )
+
+        # The stale PID is cleared, but the file stays for anyone waiting on
+        # it, so the lock is still exclusive.
+        with open( self.lock_path ) as pid_file:
+            assert '' == pid_file.read()
+        with file.FileLock( self.lock_path ):
+            assert not file.FileLock( self.lock_path ).acquire( blocking=False )
+
+    def test_shared( self ):
+        first = file.FileLock( self.lock_path, shared=True )
+        second = file.FileLock( self.lock_path, shared=True )
+        assert first.acquire( blocking=False )
+        assert second.acquire( blocking=False )
+        assert not file.FileLock( self.lock_path ).acquire( blocking=False )
+        first.release()
+        second.release()
+
+    def test_timeout( self ):
+        holder = file.FileLock( self.lock_path )
+        holder.acquire()
+        threads = threading.active_count()
+
+        # From the main thread the wait is cut short with SIGALRM.
+        start = time.time()
+        assert not file.FileLock( self.lock_path ).acquire( timeout=0.2 )
+        assert 0.15 < time.time() - start
+
+        # Other threads retry instead.
+        results = []
+        waiter = threading.Thread( target=lambda: results.append(
+            file.FileLock( self.lock_path ).acquire( timeout=0.2 )
+        ) )
+        waiter.start()
+        waiter.join()
+        assert [False] == results
+
+        # Nothing is left waiting on the lock.
+        assert threads == threading.active_count()
+        holder.release()
+        with file.FileLock( self.lock_path, timeout=0 ):
+            pass
+
+    def test_wait( self ):
+        holder = file.FileLock( self.lock_path )
+        holder.acquire()
+        timer = threading.Timer( 0.1, holder.release )
+        timer.start()
+        with file.FileLock( self.lock_path, timeout=5 ) as waiter:
+            assert waiter.locked()
+        timer.join()
+
+class FakeMountTests( FakeToolTests ):
+    def setUp( self ):
+        super( FakeMountTests, self ).setUp()
+        self.system.fake_system_tools()
+        self.mount_path = os.path.join( self.system.root, 'secure' )
+        self.block_path = os.path.join( self.system.root, 'sdb1' )
+        self.key_path = os.path.join( self.system.root, 'key' )
+        os.mkdir( self.mount_path )
+        open( self.block_path, 'w' ).close()
+        open( self.key_path, 'w' ).close()
+
+    def test_get_process_pid( self ):
+        self.system.set_pids( [12, 345] )
+        assert ['12', '345'] == file.get_process_pid( 'conky' )
+
+    def test_mount_crypt( self ):
+        file.mount_crypt(
+            self.block_path, 'secure', self.mount_path, self.key_path,
+            register_cleanup=False
+        )
+        assert file._mount_check( self.mount_path )
+        assert os.path.exists( os.path.join( self.system.mapper_dir, 'secure' ) )
+
+        file.umount_crypt( 'secure', self.mount_path )
+        assert not file._mount_check( self.mount_path )
+        assert not os.listdir( self.system.mapper_dir )
+        assert ['cryptsetup', 'mount', 'umount', 'cryptsetup'] == \
+            [c[0] for c in self.calls()]
+
+    def test_remount_locked( self ):
+        self.system.add_fs_lock( 1, [(self.mount_path, 'rw')] )
+        file.remount( self.mount_path, 'ro', register_cleanup=False )
+        assert [] == self.calls()
+        file.remount( self.mount_path, 'rw', register_cleanup=False )
+        assert [['mount', '-o', 'remount,rw', self.mount_path]] == self.calls()
+
+    def test_release_remount( self ):
+        other_path = os.path.join( self.system.root, 'other' )
+        lock_path = os.path.join(
+            self.system.remount_lock_dir, str( os.getpid() )
+        )
+        file._create_fs_lock( other_path, file.LOCK_TYPE_REMOUNT, perm='rw' )
+
+        file.remount( self.mount_path, 'rw' )
+        file.release_remount( self.mount_path, 'rw' )
+        assert [
+            ['mount', '-o', 'remount,rw', self.mount_path],
+            ['mount', '-o', 'remount,ro', self.mount_path],
+        ] == self.calls()
+
+        # Only the released mount is dropped from our lock file.
+        with open( lock_path ) as lock_file:
+            assert other_path + ':rw' == lock_file.read()
+        file._remove_fs_lock( other_path, file.LOCK_TYPE_REMOUNT )
+        assert not os.path.exists( lock_path )
+
+    def test_release_remount_in_use( self ):
+        # Another process still needs it writable, so leave it be.
+        file.remount( self.mount_path, 'rw' )
+        self.system.add_fs_lock( 1, [(self.mount_path, 'rw')] )
+        file.release_remount( self.mount_path, 'rw' )
+        assert [['mount', '-o', 'remount,rw', self.mount_path]] == self.calls()
+        assert ['1'] == os.listdir( self.system.remount_lock_dir )
+
+class FakeLibc( object ):
+    def __init__( self, result=0 ):
+        self.result = result
+        self.mounts = []
+
+    def mount( self, source, target, fs_type, flags, data ):
+        self.mounts.append( (target, flags) )
+        return self.result
+
+class RemountSyscallTests( FakeToolTests ):
+    def setUp( self ):
+        super( RemountSyscallTests, self ).setUp()
+        self.system.fake_system_tools()
+        self.mount_path = os.path.join( self.system.root, 'data' )
+        self.libc = FakeLibc()
+        self.saved = (file._libc, file.FS_REMOUNT_SYSCALL)
+        file._libc = self.libc
+        file.FS_REMOUNT_SYSCALL = True
+
+    def tearDown( self ):
+        file._libc, file.FS_REMOUNT_SYSCALL = self.saved
+        super( RemountSyscallTests, self ).tearDown()
+
+    def test_carry_over( self ):
+        self.system.add_mount(
+            '/dev/sda2', self.mount_path, options='ro,nosuid,nodev,relatime'
+        )
+        file.remount( self.mount_path, 'rw', register_cleanup=False )
+        assert [(self.mount_path, file.MS_REMOUNT | file.MS_NOSUID | \
+            file.MS_NODEV | file.MS_RELATIME)] == self.libc.mounts
+        assert [] == self.calls()
+
+    def test_set_flag( self ):
+        self.system.add_mount( '/dev/sda2', self.mount_path, options='rw,nodev' )
+        file.remount( self.mount_path, 'ro', register_cleanup=False )
+        assert [(self.mount_path, file.MS_REMOUNT | file.MS_NODEV | \
+            file.MS_RDONLY)] == self.libc.mounts
+
+    def test_exec( self ):
+        self.system.add_mount(
+            '/dev/sda2', self.mount_path, options='ro,noexec,nosuid'
+        )
+        file.remount( self.mount_path, 'exec', register_cleanup=False )
+        assert [(self.mount_path, file.MS_REMOUNT | file.MS_RDONLY | \
+            file.MS_NOSUID)] == self.libc.mounts
+
+    def test_fallback( self ):
+        self.system.add_mount( '/dev/sda2', self.mount_path, options='ro' )
+        self.libc.result = -1
+        file.remount( self.mount_path, 'rw', register_cleanup=False )
+        assert 1 == len( self.libc.mounts )
+        assert [['mount', '-o', 'remount,rw', self.mount_path]] == self.calls()
 
+    def test_not_mounted( self ):
+        file.remount( self.mount_path, 'rw', register_cleanup=False )
+        assert [] == self.libc.mounts
+        assert [['mount', '-o', 'remount,rw', self.mount_path]] == self.calls()
@@ -18,12 +18,106 @@ with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
 '''
 
 import unittest
+import sys
+import time
+import os
 from .. import gui
+from .fake_tools import FakeToolTests
 
-class GUITests( unittest.TestCase ):
-    def runTest( self ):
-        pass
+class GUITests( FakeToolTests ):
+    def setUp( self ):
+        super( GUITests, self ).setUp()
+        self.system.fake_system_tools()
+        gui._desktop_cache['up'] = None
+
+    def tearDown( self ):
+        gui._desktop_cache['up'] = None
+        super( GUITests, self ).tearDown()
 
     def test_desktop_up( self ):
+        assert gui.desktop_up() == False
+        gui._desktop_cache['up'] = None
+        self.system.set_pids( [1234] )
         assert gui.desktop_up() == True
+        assert ['pgrep', '-u', str( os.geteuid() ), '^awesome$'] == \
+            self.calls()[-1]
+
+
+class FakeNotification( object ):
+    shown = []
+
+    def __init__( self, title, message ):
+        self.title = title
+        self.message = message
+
+    def update( self, title, message ):
+        self.title = title
+        self.message = message
+
+    def show( self ):
+        FakeNotification.shown.append( (id( self ), self.title, self.message) )
+
+class FakePynotify( object ):
+    Notification = FakeNotification
+    inits = []
+
+    @staticmethod
+    def init( app_name ):
+        FakePynotify.inits.append( app_name )
+
+class NotifierTests( unittest.TestCase ):
+    def setUp( self ):
+        self.saved = sys.modules.get( 'pynotify' )
+        sys.modules['pynotify'] = FakePynotify
+        FakeNotification.shown = []
+        FakePynotify.inits = []
+
+    def tearDown( self ):
+        if None == self.saved:
+            del sys.modules['pynotify']
+        else:
+            sys.modules['pynotify'] = self.saved
+
+    def test_coalesce( self ):
+        notifier = gui.Notifier( interval=0.2 )
+        for i in range( 50 ):
+            notifier.notify( 'File {}'.format( i ), title='Copy' )
+        notifier.close()
+
+        assert ['qn-script'] == FakePynotify.inits
+        assert 1 <= len( FakeNotification.shown ) <= 3
+        assert 1 == len( set( s[0] for s in FakeNotification.shown ) )
+        title, message = FakeNotification.shown[-1][1:]
+        assert 'Copy' == title
+        assert message.startswith( 'File 49' )
+
+    def test_desktop_cache( self ):
+        calls = []
+        saved = gui.file.get_process_pid
+        gui.file.get_process_pid = lambda *a, **k: calls.append( a ) or ['1']
+        gui._desktop_cache['up'] = None
+        try:
+            assert gui.desktop_up()
+            assert gui.desktop_up()
+        finally:
+            gui.file.get_process_pid = saved
+            gui._desktop_cache['up'] = None
+        assert 1 == len( calls )
+
+    def test_pending_bound( self ):
+        notifier = gui.Notifier( interval=60 )
+        notifier.notify( 'first' )
+        time.sleep( 0.1 )
+        for i in range( gui.NOTIFY_PENDING_MAX + 50 ):
+            notifier.notify( 'File {}'.format( i ) )
+        assert gui.NOTIFY_PENDING_MAX == len( notifier._pending )
+        notifier.close()
+
+        assert 2 == len( FakeNotification.shown )
+        assert 'File {}\n(+{} more)'.format(
+            gui.NOTIFY_PENDING_MAX + 49, gui.NOTIFY_PENDING_MAX + 49
+        ) == FakeNotification.shown[-1][2]
 
+    def test_init_failure( self ):
+        sys.modules['pynotify'] = None
+        self.assertRaises( ImportError, gui.Notifier )
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import subprocess
+import sys
+import os
+
+# Most seconds importing a lightweight module may take in a fresh interpreter.
+IMPORT_BUDGET = 0.15
+
+PACKAGE_ROOT = os.path.dirname( os.path.dirname( os.path.dirname(
+    os.path.abspath( __file__ )
+) ) )
+
+def _run( code ):
+    return subprocess.check_output(
+        [sys.executable, '-c', code], cwd=PACKAGE_ROOT
+    ).strip()
+
+def _import_time( module ):
+    return float( _run(
+        'import time\n' \
+        't = time.time()\n' \
+        'import {}\n' \
+        'print( time.time() - t )'.format( module )
+    ) )
+
+class ImportTests( unittest.TestCase ):
+    def runTest( self ):
+        pass
+
+    def test_budget( self ):
+        for module in ['ifdyutil', 'ifdyutil.file', 'ifdyutil.config']:
+            # Take the best of a few runs to ride out a busy machine.
+            elapsed = min( _import_time( module ) for i in range( 3 ) )
+            assert IMPORT_BUDGET > elapsed, \
+                '{} took {:.3f}s to import'.format( module, elapsed )
+
+    def test_lazy( self ):
+        assert 'False True' == _run(
+            'import sys\n' \
+            'import ifdyutil\n' \
+            'loaded = "ifdyutil.config" in sys.modules\n' \
+            'ifdyutil.config.check_root\n' \
+            'print( "{} {}".format(\n' \
+            '    loaded, "ifdyutil.config" in sys.modules\n' \
+            ') )'
+        )
+
+    def test_all( self ):
+        assert '[]' == _run(
+            'import ifdyutil\n' \
+            'print( [m for m in ifdyutil.__all__ ' \
+                'if not hasattr( ifdyutil, m )] )'
+        )
+
+    def test_deferred( self ):
+        assert '[]' == _run(
+            'import sys\n' \
+            'import ifdyutil.archive, ifdyutil.gui\n' \
+            'print( [m for m in ["whoosh", "pbkdf2", "Crypto", "pynotify"] ' \
+                'if m in sys.modules] )'
+        )
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import tempfile
+import shutil
+import os
+import sys
+import time
+import StringIO
+from .. import nagios
+
+class NagiosTests( unittest.TestCase ):
+    def runTest( self ):
+        pass
+
+    def test_perfdata( self ):
+        result = nagios.CheckResult( nagios.WARNING, 'Disk getting full' )
+        result.add_perfdata( '/', 85, '%', 80, 90, 0, 100 )
+        result.add_perfdata( 'inodes used', 1200 )
+        result.add_perfdata( "it's", 1, warn=2 )
+        result.add_line( 'Second line' )
+        assert "WARNING - Disk getting full | /=85%;80;90;0;100 " \
+            "'inodes used'=1200 'it''s'=1;2\nSecond line" == result.output()
+
+    def test_exit( self ):
+        saved_stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            nagios.CheckResult( nagios.CRITICAL, 'Down' ).exit()
+        except SystemExit as exc:
+            assert nagios.CRITICAL == exc.code
+        else:
+            assert False
+        finally:
+            output = sys.stdout.getvalue()
+            sys.stdout = saved_stdout
+        assert 'CRITICAL - Down\n' == output
+
+class PassiveBatchTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.root )
+
+    def _batch( self, batch ):
+        for i in range( 200 ):
+            result = nagios.CheckResult(
+                nagios.OK, 'Fine', host='host{}'.format( i ), service='svc'
+            )
+            result.add_line( 'more' )
+            batch.add( result )
+        batch.add( nagios.CheckResult( nagios.CRITICAL, 'Down', host='h' ) )
+        batch.flush()
+        assert [] == batch.results
+
+    def test_command_file( self ):
+        command_path = os.path.join( self.root, 'nagios.cmd' )
+        open( command_path, 'w' ).close()
+        self._batch( nagios.PassiveBatch( command_file=command_path ) )
+        with open( command_path ) as command_file:
+            lines = command_file.readlines()
+        assert 201 == len( lines )
+        assert lines[0].endswith(
+            'PROCESS_SERVICE_CHECK_RESULT;host0;svc;0;OK - Fine\\nmore\n'
+        )
+        assert lines[-1].endswith(
+            'PROCESS_HOST_CHECK_RESULT;h;2;CRITICAL - Down\n'
+        )
+
+    def test_command_fifo( self ):
+        command_path = os.path.join( self.root, 'nagios.cmd' )
+        os.mkfifo( command_path )
+        batch = nagios.PassiveBatch( command_file=command_path )
+
+        # Nobody reading, as when Nagios is down.
+        batch.add( nagios.CheckResult( nagios.OK, 'Fine', host='h' ) )
+        self.assertRaises( IOError, batch.flush )
+
+        reader = os.open( command_path, os.O_RDONLY | os.O_NONBLOCK )
+        try:
+            batch.flush()
+            assert os.read( reader, 4096 ).endswith(
+                'PROCESS_HOST_CHECK_RESULT;h;0;OK - Fine\n'
+            )
+        finally:
+            os.close( reader )
+
+    def test_spool( self ):
+        self._batch( nagios.PassiveBatch( spool_dir=self.root ) )
+        names = sorted( os.listdir( self.root ) )
+        assert 2 == len( names )
+        assert 7 == len( names[0] ) and names[0].startswith( 'c' )
+        assert names[0] + '.ok' == names[1]
+        with open( os.path.join( self.root, names[0] ) ) as spool_file:
+            spool = spool_file.read()
+        assert 200 == spool.count( '### Nagios Service Check Result ###' )
+        assert 'output=OK - Fine\\nmore\n' in spool
+
+PLUGIN = """
+from ifdyutil import nagios
+
+def check_disk():
+    result = nagios.CheckResult( nagios.OK, 'Disk fine' )
+    result.add_perfdata( 'used', 10, '%' )
+    return result
+
+def check_legacy():
+    nagios.exit_warning( 'Old style' )
+
+def check_broken():
+    raise ValueError( 'oops' )
+
+def register( runner ):
+    runner.add_check( check_disk, interval=0.1, host='localhost' )
+    runner.add_check( check_legacy, interval=0.1, host='localhost' )
+    runner.add_check( check_broken, interval=0.1, host='localhost' )
+"""
+
+class CheckRunnerTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+        with open( os.path.join( self.root, 'plugin.py' ), 'w' ) as f:
+            f.write( PLUGIN )
+        self.runner = nagios.CheckRunner( threads=2 )
+        self.runner.load_plugins( self.root )
+
+    def tearDown( self ):
+        shutil.rmtree( self.root )
+
+    def test_run_once( self ):
+        results = self.runner.run_once()
+        assert ['check_disk', 'check_legacy', 'check_broken'] == \
+            [r.service for r in results]
+        assert [nagios.OK, nagios.WARNING, nagios.UNKNOWN] == \
+            [r.status for r in results]
+        assert 'OK - Disk fine | used=10%' == results[0].output()
+        assert 'WARNING - Old style' == results[1].output()
+        assert nagios.WARNING == nagios.worst_status( results )
+
+    def test_run( self ):
+        command_path = os.path.join( self.root, 'nagios.cmd' )
+        open( command_path, 'w' ).close()
+        self.runner.batch = nagios.PassiveBatch( command_file=command_path )
+        self.runner.run( duration=0.35 )
+        with open( command_path ) as command_file:
+            lines = command_file.readlines()
+        disk_lines = [l for l in lines if ';check_disk;' in l]
+        assert 3 <= len( disk_lines ) <= 5
+        assert disk_lines[0].endswith(
+            'PROCESS_SERVICE_CHECK_RESULT;localhost;check_disk;0;' \
+            'OK - Disk fine | used=10%\n'
+        )
+
+    def test_sys_exit( self ):
+        def exit_with( code ):
+            sys.exit( code )
+
+        runner = nagios.CheckRunner()
+        for code in [None, 0, 2, 7, 'Disk gone']:
+            runner.add_check( exit_with, args=(code,) )
+        results = runner.run_once()
+        assert [nagios.OK, nagios.OK, nagios.CRITICAL, nagios.UNKNOWN,
+            nagios.UNKNOWN] == [r.status for r in results]
+        assert 'UNKNOWN - Disk gone' == results[4].output()
+        assert nagios.CRITICAL == nagios.worst_status( results )
+
+    def test_command_fifo_unread( self ):
+        command_path = os.path.join( self.root, 'nagios.cmd' )
+        os.mkfifo( command_path )
+        self.runner.batch = nagios.PassiveBatch( command_file=command_path )
+        time_start = time.time()
+        self.runner.run( duration=0.25 )
+        assert 2 > time.time() - time_start
+        assert [] == self.runner.batch.results
+
+    def test_command_file_missing( self ):
+        command_path = os.path.join( self.root, 'missing', 'nagios.cmd' )
+        self.runner.batch = nagios.PassiveBatch( command_file=command_path )
+        self.runner.run( duration=0.25 )
+        assert [] == self.runner.batch.results
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import unittest
+import os
+import sys
+import time
+import StringIO
+from .. import net
+from .fake_tools import FakeToolTests
+
+# Stand-in ssh that skips options and runs the command locally.
+FAKE_SSH = '''while [ "${1#-}" != "$1" ]; do shift 2; done
+shift
+exec sh -c "$*"'''
+
+class SSHTests( FakeToolTests ):
+
+    def setUp( self ):
+        super( SSHTests, self ).setUp()
+        self.saved_control_dir = net.SSH_CONTROL_DIR
+        net.SSH_CONTROL_DIR = os.path.join( self.bin_dir, 'control' )
+        self.fake_tool( 'ssh', FAKE_SSH )
+
+    def tearDown( self ):
+        net.SSH_CONTROL_DIR = self.saved_control_dir
+        super( SSHTests, self ).tearDown()
+
+    def test_unsafe( self ):
+        assert 3 == net.ssh_command_unsafe( 'host', ['true', 'exit 3'] )
+        assert ['ssh', 'host', 'true', '&&', 'exit', '3'] == self.calls()[0]
+
+    def test_pooled( self ):
+        result = net.ssh_command_pooled(
+            'host', 'echo out; echo err >&2; exit 2', persist=60
+        )
+        assert (2, 'out\n', 'err\n') == result
+        call = self.calls()[0]
+        assert 'ControlMaster=auto' in call
+        assert 'ControlPersist=60' in call
+        assert 'host' == call[7]
+        assert os.path.isdir( net.SSH_CONTROL_DIR )
+
+    def test_control_dir_unsafe( self ):
+        target_path = os.path.join( self.bin_dir, 'elsewhere' )
+        os.mkdir( target_path, 0700 )
+        os.symlink( target_path, net.SSH_CONTROL_DIR )
+        self.assertRaises( net.SSHException, net._ssh_control_args )
+
+        os.unlink( net.SSH_CONTROL_DIR )
+        os.mkdir( net.SSH_CONTROL_DIR )
+        os.chmod( net.SSH_CONTROL_DIR, 0777 )
+        self.assertRaises( net.SSHException, net._ssh_control_args )
+
+        os.chmod( net.SSH_CONTROL_DIR, 0700 )
+        assert 'ControlMaster=auto' in net._ssh_control_args()
+
+    def test_many( self ):
+        output = StringIO.StringIO()
+        time_start = time.time()
+        results = net.ssh_command_many(
+            ['a', 'b', 'c', 'd'], 'sleep 0.3; echo done', max_jobs=4,
+            output=output
+        )
+        assert time.time() - time_start < 1.0
+        assert ['a', 'b', 'c', 'd'] == sorted( results.keys() )
+        for remote_host, result in results.items():
+            assert 0 == result['returncode']
+            assert 'done\n' == result['stdout']
+            assert '{}: done\n'.format( remote_host ) in output.getvalue()
+
+    def test_many_timeout( self ):
+        results = net.ssh_command_many( ['a', 'b'], 'sleep 5', timeout=0.2 )
+        for result in results.values():
+            assert result['timed_out']
+            assert result['elapsed'] < 2
+
+    def test_main( self ):
+        saved_stdout, saved_stderr = sys.stdout, sys.stderr
+        sys.stdout = StringIO.StringIO()
+        sys.stderr = StringIO.StringIO()
+        try:
+            status = net.main( ['-H', 'a', '-H', 'b', 'exit', '1'] )
+        finally:
+            sys.stdout, sys.stderr = saved_stdout, saved_stderr
+        assert 1 == status
+
+    def test_upload( self ):
+        remote_path = os.path.join( self.bin_dir, 'remote file.bin' )
+        with net.ssh_upload( 'host', remote_path ) as remote_file:
+            for i in range( 64 ):
+                remote_file.write( chr( i ) * 4096 )
+            assert not os.path.exists( remote_path )
+        with open( remote_path, 'rb' ) as check_file:
+            data = check_file.read()
+        assert 64 * 4096 == len( data )
+        assert chr( 63 ) * 4096 == data[-4096:]
+
+        with net.ssh_download( 'host', remote_path ) as remote_file:
+            assert data == remote_file.read()
+
+    def test_upload_abort( self ):
+        remote_path = os.path.join( self.bin_dir, 'aborted' )
+        try:
+            with net.ssh_upload( 'host', remote_path ) as remote_file:
+                remote_file.write( 'partial' )
+                raise ValueError()
+        except ValueError:
+            pass
+        assert not os.path.exists( remote_path )
+
+    def test_download_missing( self ):
+        remote_file = net.ssh_download( 'host', '/nonexistent/file' )
+        assert '' == remote_file.read()
+        self.assertRaises( IOError, remote_file.close )
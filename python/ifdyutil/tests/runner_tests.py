@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+import unittest
+import tempfile
+import shutil
+import socket
+import threading
+import os
+from .. import runner
+
+class RecordingSink( object ):
+    def __init__( self ):
+        self.results = []
+
+    def record( self, result ):
+        self.results.append( result )
+
+class RunnerTests( unittest.TestCase ):
+    def setUp( self ):
+        self.root = tempfile.mkdtemp()
+        self.sink = RecordingSink()
+        runner.add_sink( self.sink )
+
+    def tearDown( self ):
+        runner.remove_sink( self.sink )
+        shutil.rmtree( self.root )
+
+    def test_run( self ):
+        result = runner.run( ['sh', '-c', 'echo out; echo err >&2; exit 3'] )
+        assert 3 == result.returncode
+        assert not result.success
+        assert 'out\n' == result.stdout
+        assert 'err\n' == result.stderr
+        assert 'sh' == result.tool
+        assert [result] == self.sink.results
+
+    def test_timeout( self ):
+        result = runner.run( ['sleep', '5'], timeout=0.1 )
+        assert result.timed_out
+        assert 0 > result.returncode
+        assert 1 > result.elapsed
+
+    def test_missing( self ):
+        self.assertRaises( OSError, runner.run, ['/nonexistent/tool'] )
+        assert None == self.sink.results[0].returncode
+
+    def test_stats( self ):
+        calls = runner.STATS.snapshot().get( 'true', {} ).get( 'calls', 0 )
+        runner.run( ['true'] )
+        runner.run( ['true'] )
+        stats = runner.STATS.snapshot()['true']
+        assert calls + 2 == stats['calls']
+        assert stats['calls'] == stats['buckets'][-1]
+
+    def test_prometheus( self ):
+        prom_path = os.path.join( self.root, 'ifdyutil.prom' )
+        sink = runner.PrometheusTextfileSink( prom_path, interval=0 )
+        runner.add_sink( sink )
+        try:
+            runner.run( ['false'] )
+        finally:
+            runner.remove_sink( sink )
+        with open( prom_path ) as prom_file:
+            prom = prom_file.read()
+        assert 'ifdyutil_command_calls_total{tool="false"} 1\n' in prom
+        assert 'ifdyutil_command_failures_total{tool="false"} 1\n' in prom
+        assert 'ifdyutil_command_duration_seconds_bucket{tool="false",' \
+            'le="+Inf"} 1\n' in prom
+
+    def test_statsd( self ):
+        server = socket.socket( socket.AF_INET, socket.SOCK_DGRAM )
+        server.bind( ('127.0.0.1', 0) )
+        server.settimeout( 5 )
+        sink = runner.StatsdSink( server.getsockname() )
+        runner.add_sink( sink )
+        try:
+            runner.run( ['true'] )
+        finally:
+            runner.remove_sink( sink )
+        lines = server.recv( 4096 ).split( '\n' )
+        server.close()
+        assert lines[0].startswith( 'ifdyutil.command.true.duration:' )
+        assert 'ifdyutil.command.true.calls:1|c' == lines[1]
+
+    def test_sink_error( self ):
+        class BrokenSink( object ):
+            def record( self, result ):
+                raise IOError( 'disk full' )
+
+        sink = BrokenSink()
+        runner.add_sink( sink )
+        try:
+            result = runner.run( ['true'] )
+        finally:
+            runner.remove_sink( sink )
+        assert result.success
+
+    def test_prometheus_threads( self ):
+        prom_path = os.path.join( self.root, 'ifdyutil.prom' )
+        sink = runner.PrometheusTextfileSink( prom_path, interval=0 )
+        errors = []
+
+        def flush():
+            try:
+                for i in range( 50 ):
+                    sink.flush()
+            except Exception as exc:
+                errors.append( exc )
+
+        threads = [threading.Thread( target=flush ) for i in range( 4 )]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert [] == errors
+        assert ['ifdyutil.prom'] == os.listdir( self.root )
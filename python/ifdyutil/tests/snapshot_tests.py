@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+'''
+This file is part of IFDYUtil.
+
+IFDYUtil is free software: you can redistribute it and/or modify it under the 
+terms of the GNU Lesser General Public License as published by the Free
+Software Foundation, either version 3 of the License, or (at your option) any
+later version.
+
+IFDYUtil is distributed in the hope that it will be useful, but WITHOUT ANY 
+WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+PARTICULAR PURPOSE.  See the GNU Lesser General Public License for more 
+details.
+
+You should have received a copy of the GNU Lesser General Public License along
+with IFDYUtil.  If not, see <http://www.gnu.org/licenses/>.
+'''
+
+import unittest
+import os
+import time
+import json
+from .. import snapshot
+from .fake_tools import FakeToolTests
+
+def _stamp( days_ago ):
+    return time.strftime(
+        '%Y-%m-%d %H:%M:%S +0000', time.gmtime( time.time() - days_ago * 86400 )
+    )
+
+class LVMInventoryTests( FakeToolTests ):
+
+    ROWS = [
+        ('root', 'vg0', '-wi-ao----', '', '10737418240', 40, ''),
+        ('root20150101', 'vg0', 'swi-a-s---', 'root', '1073741824', 30, '1.50'),
+        ('root20150110', 'vg0', 'swi-a-s---', 'root', '1073741824', 10, '0.50'),
+        ('root20150119', 'vg0', 'swi-a-s---', 'root', '1073741824', 1, '0.10'),
+        ('home', 'vg1', '-wi-ao----', '', '21474836480', 40, ''),
+        ('home20150101', 'vg1', 'swi-a-s---', 'home', '1073741824', 30, '2.00'),
+    ]
+
+    def setUp( self ):
+        super( LVMInventoryTests, self ).setUp()
+        snapshot._lvs_json = True
+        rows = [dict( zip( snapshot.LVS_FIELDS, (
+            r[0], r[1], r[2], r[3], r[4], _stamp( r[5] ), r[6]
+        ) ) ) for r in self.ROWS]
+        with open( os.path.join( self.bin_dir, 'lvs.json' ), 'w' ) as f:
+            json.dump( {'report': [{'lv': rows}]}, f )
+        with open( os.path.join( self.bin_dir, 'lvs.txt' ), 'w' ) as f:
+            for row in rows:
+                f.write( '  {}\n'.format( snapshot.LVS_SEPARATOR.join(
+                    row[k] for k in snapshot.LVS_FIELDS
+                ) ) )
+        self.fake_tool( 'lvremove', '' )
+
+    def test_inventory_json( self ):
+        self.fake_tool( 'lvs', 'cat "{}/lvs.json"'.format( self.bin_dir ) )
+        inventory = snapshot.inventory_lvm()
+        assert 1 == len( self.calls() )
+        assert 6 == len( inventory.volumes )
+        assert 10737418240 == inventory.volume( 'root', 'vg0' )['size']
+        snaps = inventory.snapshots( 'root', 'vg0' )
+        assert ['root20150101', 'root20150110', 'root20150119'] == \
+            [s['name'] for s in snaps]
+        assert 29 < inventory.age( snaps[0] ) / 86400 < 31
+
+    def test_inventory_separator( self ):
+        self.fake_tool( 'lvs', '''case "$*" in
+    *json*) exit 3 ;;
+    *) cat "{}/lvs.txt" ;;
+esac'''.format( self.bin_dir ) )
+        inventory = snapshot.inventory_lvm()
+        assert 0.5 == inventory.snapshots( 'root', 'vg0' )[1]['percent']
+        assert 1 == len( inventory.snapshots( 'home', 'vg1' ) )
+
+        # Don't try JSON again once it's known not to work.
+        snapshot.inventory_lvm()
+        assert 3 == len( self.calls() )
+
+    def test_clean_snapshots( self ):
+        self.fake_tool( 'lvs', 'cat "{}/lvs.json"'.format( self.bin_dir ) )
+        assert snapshot.clean_snapshots_lvm( 'root', 'vg0', 7 )
+        removes = [c for c in self.calls() if 'lvremove' == c[0]]
+        assert [['lvremove', '-f', 'vg0/root20150101', 'vg0/root20150110']] == \
+            removes
+
+    def test_clean_snapshots_none( self ):
+        self.fake_tool( 'lvs', 'cat "{}/lvs.json"'.format( self.bin_dir ) )
+        assert snapshot.clean_snapshots_lvm( 'home', 'vg1', 60 )
+        assert not [c for c in self.calls() if 'lvremove' == c[0]]
+
+class ScheduleSnapshotTests( FakeToolTests ):
+
+    # Each fake lvcreate notes how many (in all, and in its VG) are running
+    # once it has started.
+    LVCREATE = '''target=$(eval echo \\${{$#}})
+vg=${{target%%/*}}
+touch "{0}/$vg.$$"
+ls "{0}" | wc -l >> "{1}/peak"
+ls "{0}" | grep -c "^$vg\\." >> "{1}/peak_vg"
+sleep 0.2
+rm "{0}/$vg.$$"
+case "$*" in
+    *bad*) echo "Volume group full" >&2; exit 5 ;;
+esac'''
+
+    def setUp( self ):
+        super( ScheduleSnapshotTests, self ).setUp()
+        self.running_dir = os.path.join( self.system.root, 'running' )
+        os.mkdir( self.running_dir )
+        self.fake_tool( 'lvcreate', self.LVCREATE.format(
+            self.running_dir, self.system.root
+        ) )
+
+    def peak( self, name ):
+        with open( os.path.join( self.system.root, name ) ) as peak_file:
+            return max( int( line ) for line in peak_file )
+
+    def test_schedule( self ):
+        targets = [
+            ('vg0', 'root', '1G'),
+            ('vg0', 'var', '1G'),
+            ('vg1', 'home', '2G'),
+            ('vg2', 'bad', '1G'),
+        ]
+        results = snapshot.schedule_snapshots_lvm( targets, ssname='test' )
+
+        # vg0 is limited to one at a time, everything else overlaps.
+        assert 1 == self.peak( 'peak_vg' )
+        assert 1 < self.peak( 'peak' ) <= 3
+        assert 4 == len( self.calls() )
+        assert ['roottest', 'vartest', 'hometest', 'badtest'] == \
+            [r['name'] for r in results]
+        assert [True, True, True, False] == [r['success'] for r in results]
+        assert 5 == results[3]['returncode']
+        assert 'Volume group full' == results[3]['error']
+        for result in results:
+            assert 0.15 < result['elapsed']
+
+    def test_schedule_global_limit( self ):
+        targets = [('vg{}'.format( i ), 'lv', '1G') for i in range( 4 )]
+        results = snapshot.schedule_snapshots_lvm( targets, max_jobs=2 )
+        assert 1 < self.peak( 'peak' ) <= 2
+        assert all( r['success'] for r in results )
+
+    def test_schedule_limits( self ):
+        targets = [('vg0', 'root', '1G')]
+        self.assertRaises(
+            ValueError, snapshot.schedule_snapshots_lvm, targets, max_jobs=0
+        )
+        self.assertRaises(
+            ValueError, snapshot.schedule_snapshots_lvm, targets, max_per_vg=0
+        )
+        assert [] == self.calls()
+
+class ZFSSnapshotTests( FakeToolTests ):
+
+    SNAPSHOTS = [
+        ('tank/home@20150101', 30, 1024, 4096),
+        ('tank/home@20150120', 2, 512, 4096),
+        ('tank/home/alice@20150101', 30, 256, 1024),
+        ('tank/var@20150101', 30, 2048, 8192),
+    ]
+
+    def setUp( self ):
+        super( ZFSSnapshotTests, self ).setUp()
+        with open( os.path.join( self.bin_dir, 'zfs.txt' ), 'w' ) as f:
+            for name, days_ago, used, referenced in self.SNAPSHOTS:
+                f.write( '{}\t{}\t{}\t{}\n'.format(
+                    name, int( time.time() - days_ago * 86400 ), used,
+                    referenced
+                ) )
+        self.fake_tool( 'zfs', '''case "$1" in
+    list) cat "{}/zfs.txt" ;;
+esac'''.format( self.bin_dir ) )
+
+    def test_snapshot( self ):
+        assert snapshot.snapshot_zfs(
+            ['tank/home', 'tank/var'], ssname='test', recursive=True
+        )
+        assert [['zfs', 'snapshot', '-r', 'tank/home@test', 'tank/var@test']] \
+            == self.calls()
+
+    def test_list( self ):
+        snapshots = snapshot.list_snapshots_zfs()
+        assert ['tank/home', 'tank/home/alice', 'tank/var'] == \
+            sorted( snapshots.keys() )
+        assert ['20150101', '20150120'] == \
+            [s['snapshot'] for s in snapshots['tank/home']]
+        assert 2048 == snapshots['tank/var'][0]['used']
+
+        snapshots = snapshot.list_snapshots_zfs( 'tank/home' )
+        assert ['tank/home'] == snapshots.keys()
+
+    def test_clean( self ):
+        assert snapshot.clean_snapshots_zfs( 'tank/home', 7, recursive=True )
+        destroys = [c for c in self.calls() if 'destroy' == c[1]]
+        assert [
+            ['zfs', 'destroy', 'tank/home@20150101'],
+            ['zfs', 'destroy', 'tank/home/alice@20150101'],
+        ] == destroys
@@ -29,6 +29,13 @@ if 'test' in sys.argv:
     os.chdir( './ifdyutil/tests' )
     subprocess.call( ['nosetests', 'file_tests.py'] )
     subprocess.call( ['nosetests', 'config_tests.py'] )
+    subprocess.call( ['nosetests', 'snapshot_tests.py'] )
+    subprocess.call( ['nosetests', 'net_tests.py'] )
+    subprocess.call( ['nosetests', 'nagios_tests.py'] )
+    subprocess.call( ['nosetests', 'import_tests.py'] )
+    subprocess.call( ['nosetests', 'runner_tests.py'] )
+    subprocess.call( ['nosetests', 'console_tests.py'] )
+    subprocess.call( ['nosetests', 'archive_tests.py'] )
     exit()
 
 setup(